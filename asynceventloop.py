@@ -0,0 +1,241 @@
+'''
+
+'''
+
+import asyncio
+import json
+import threading
+import time
+import zmq
+import zmq.asyncio
+from eventloop import EventLoop, EventloopError, _BLOCKED_POLL_MS
+
+class AsyncEventLoop(EventLoop):
+    '''
+    Same protocol as EventLoop, running on asyncio: every stream is served by its own task that waits
+    for its credit and pacing deadlines, and files of started streams are loaded in an executor,
+    so that a slow or credit-starved stream never delays another
+    '''
+
+
+    def __init__(self, zeromq_context, control_endpoint, exchange_id, config=None):
+        super().__init__(zeromq_context, control_endpoint, exchange_id, config)
+        # Task serving each stream, and event that wakes it up when credit arrives
+        self.tasks = {}
+        self.wakeups = {}
+        # Last start command of each peer, so that a start that finishes loading after a newer one is dropped
+        self.starting = {}
+        # Task serving each shared replay session, and event that wakes it up when its members give credit or join
+        self.session_tasks = {}
+        self.session_wakeups = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.eventLoopAsync(),))
+        self.thread.start()
+
+    async def eventLoopAsync(self):
+        actx = zmq.asyncio.Context.shadow(self.ctx.underlying)
+        self.receiver = actx.socket(zmq.ROUTER)
+        self.receiver.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.receiver.bind(self.control_endpoint_name)
+        # Packets are sent and received through blocking socket object of the same socket, without waiting as all of them
+        # are non-blocking, and the asyncio socket is only polled. Creating futures for every send is too slow for data
+        self.control = zmq.Socket.shadow(self.receiver.underlying)
+
+        self.run = True
+        self.startConfiguredProfile()
+        while self.run:
+            # Stream tasks take waiting packets between their bursts as well, which may leave nothing to read after a wakeup;
+            # the timeout covers readiness notifications lost to their sends
+            await self.receiver.poll(100)
+            self.receivePackets()
+            if self.profiler is not None and self.profiler.expired(time.monotonic()):
+                self.stopProfile()
+
+        tasks = list(self.tasks.values()) + list(self.starting.values()) + list(self.session_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.stopProfile()
+        self.receiver.close()
+
+    def processCommand(self, peer_id, command):
+        if command.get("command") == "start":
+            previous = self.starting.get(peer_id)
+            if previous is not None:
+                previous.cancel()
+            self.starting[peer_id] = asyncio.get_running_loop().create_task(self.handleStartAsync(peer_id, command))
+        else:
+            super().processCommand(peer_id, command)
+
+    def incrementStreamCredit(self, peer_id, count=1):
+        super().incrementStreamCredit(peer_id, count)
+        wakeup = self.wakeups.get(peer_id)
+        if wakeup is None and peer_id in self.members:
+            wakeup = self.session_wakeups.get(self.members[peer_id])
+        if wakeup is not None:
+            wakeup.set()
+
+    async def handleStartAsync(self, peer_id, command):
+        try:
+            (from_dt, to_dt, delay, lazy, batch, speed, interval) = self._startOptions(command)
+            if "session" in command:
+                src = await asyncio.get_running_loop().run_in_executor(None, self._startSources, command, from_dt, to_dt, interval)
+                self.joinSession(peer_id, command, src, (from_dt, to_dt, delay, lazy, batch, speed, interval))
+                self.session_wakeups[self.members[peer_id]].set()
+                return
+            if peer_id in self.streams:
+                self.stopStream(peer_id)
+            self.leaveSession(peer_id)
+            loading = asyncio.get_running_loop().run_in_executor(None, self.createStreamFor, command,
+                                                                 from_dt, to_dt, delay, lazy, batch, speed, interval)
+            try:
+                stream = await asyncio.shield(loading)
+            except asyncio.CancelledError:
+                # Superseded by a newer start command of the peer: the stream is closed once it is loaded
+                loading.add_done_callback(lambda f: f.cancelled() or f.exception() is not None or f.result().close())
+                raise
+        except EventloopError as e:
+            self._sendReply(peer_id, {"result" : "error", "reason" : str(e)})
+            return
+        finally:
+            if self.starting.get(peer_id) is asyncio.current_task():
+                del self.starting[peer_id]
+
+        self.streams[peer_id] = stream
+        self.wakeups[peer_id] = asyncio.Event()
+        self.tasks[peer_id] = asyncio.get_running_loop().create_task(self.serveStream(peer_id, stream))
+        self._sendReply(peer_id, {"result" : "success"})
+
+    def createStreamFor(self, command, from_dt, to_dt, delay, lazy, batch, speed, interval):
+        # Looking files up in the catalog may rescan the data root, so it runs in the executor as well
+        src = self._startSources(command, from_dt, to_dt, interval)
+        return self.createStream(src, from_dt, to_dt, delay, lazy, batch, speed, None, interval, command.get("position"))
+
+    def loadSession(self, session, src, options):
+        self.session_wakeups[session] = asyncio.Event()
+        self.session_tasks[session] = asyncio.get_running_loop().create_task(self.serveSession(session, src, options))
+
+    def closeSession(self, session):
+        super().closeSession(session)
+        task = self.session_tasks.pop(session, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        self.session_wakeups.pop(session, None)
+
+    def _schedule(self, peer_id, stream, deadline):
+        # Tasks sleep until their deadlines themselves
+        stream.deadline = deadline
+
+    async def serveSession(self, session, src, options):
+        '''
+        Loads stream of the session in the executor, and then sends its items to the members as their credit allows
+        '''
+        (from_dt, to_dt, delay, lazy, batch, speed, interval) = options
+        loading = asyncio.get_running_loop().run_in_executor(None, self.createStream, src, from_dt, to_dt, delay,
+                                                             lazy, batch, speed, None, interval)
+        try:
+            stream = await asyncio.shield(loading)
+        except asyncio.CancelledError:
+            loading.add_done_callback(lambda f: f.cancelled() or f.exception() is not None or f.result().close())
+            raise
+        except EventloopError as e:
+            for peer_id in list(session.members):
+                self._sendReply(peer_id, {"result" : "error", "reason" : str(e)})
+            self.closeSession(session)
+            return
+        session.stream = stream
+        for peer_id in session.members:
+            self._sendReply(peer_id, {"result" : "success"})
+
+        wakeup = self.session_wakeups[session]
+        while True:
+            self.receivePackets()
+            if self.sessions.get(session.name) is not session:
+                return
+            busy = self.processSession(session, time.monotonic())
+            if self.sessions.get(session.name) is not session:
+                return
+            if busy:
+                await asyncio.sleep(0)
+            elif session.remaining:
+                await asyncio.sleep(_BLOCKED_POLL_MS / 1000)
+            elif stream.deadline is not None:
+                await asyncio.sleep(max(stream.deadline - time.monotonic(), 0))
+            else:
+                wakeup.clear()
+                await wakeup.wait()
+
+    def stopStream(self, peer_id):
+        task = self.tasks.pop(peer_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        self.wakeups.pop(peer_id, None)
+        super().stopStream(peer_id)
+
+    async def serveStream(self, peer_id, stream):
+        '''
+        Sends items of the stream as its credit and pacing allow, yielding to other tasks after every 'stream-budget' items
+        '''
+        wakeup = self.wakeups[peer_id]
+        loop = asyncio.get_running_loop()
+        budget = self.stream_budget
+        while True:
+            if stream.credit <= 0 or budget <= 0:
+                # Packets that arrived during the burst are taken before waiting, as the sends may have used up their wakeup
+                self.receivePackets()
+                if self.streams.get(peer_id) is not stream:
+                    return
+                if budget <= 0:
+                    budget = self.stream_budget
+                    await asyncio.sleep(0)
+                while stream.credit <= 0 and stream.error is None:
+                    wakeup.clear()
+                    await wakeup.wait()
+            if stream.error is not None:
+                self._sendReply(peer_id, {"result" : "error", "reason" : stream.error})
+                break
+
+            max_items = min(stream.credit, budget, max(stream.batch, 1))
+            item_time = None
+            due = None
+            if stream.pacer is not None:
+                item_time = stream.peek_time()
+                due = stream.pacer.due(item_time)
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.receivePackets()
+                    await asyncio.sleep(wait)
+                max_items = 1
+            # Items taken from here on are not sent until the send below
+            stream.unsent = stream.taken
+            if stream.readers:
+                # Lazy sources may wait for their parser thread at chunk boundaries
+                self.receivePackets()
+                next_item = await loop.run_in_executor(None, stream.next_packets, max_items)
+            else:
+                next_item = stream.next_packets(max_items)
+            if self.streams.get(peer_id) is not stream:
+                return
+            packet = self._nextPacket(stream, next_item, item_time, due)
+            if packet is None:
+                break
+
+            (ticker_frame, payload, copy, count, item_time, due) = packet
+            try:
+                while not self._sendData(peer_id, ticker_frame, payload, copy):
+                    self.receivePackets()
+                    await asyncio.sleep(_BLOCKED_POLL_MS / 1000)
+            except zmq.ZMQError as e:
+                print("Error: unable to send data to peer:", e)
+                break
+            stream.unsent = None
+            stream.credit -= count
+            stream.items_sent += count
+            stream.bytes_sent += len(payload)
+            if stream.pacer is not None:
+                stream.pacer.sent(time.monotonic(), item_time, due)
+            budget -= count
+
+        if self.streams.get(peer_id) is stream:
+            self.stopStream(peer_id)
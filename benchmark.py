@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+'''
+
+'''
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import numpy as np
+import zmq
+import csvloader
+import utils
+import wire
+from eventloop import EventLoop, QuoteStream
+
+# Synthetic files start at this time and use 1 minute bars
+_START = datetime.datetime(2015, 1, 5, 10, 0, 0)
+_BAR_SECONDS = 60
+_BLOCK_ROWS = 1 << 20
+
+def digits(values, width):
+    '''
+    Formats non-negative integers as (rows, width) matrix of zero-padded ASCII digits
+    '''
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return (values[:, None] // powers % 10 + 48).astype(np.uint8)
+
+def constant(text, rows):
+    return np.tile(np.frombuffer(text.encode('utf-8'), dtype=np.uint8), (rows, 1))
+
+def price_text(cents):
+    '''
+    Formats prices given in hundredths as 'DDD.DD'
+    '''
+    return np.hstack((digits(cents // 100, 3), constant(".", len(cents)), digits(cents % 100, 2)))
+
+def civil_from_days(days):
+    '''
+    Converts arrays of days since 1970-01-01 to (year, month, day) arrays, inverse of csvloader.days_from_civil
+    '''
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + np.where(mp < 10, 3, -9)
+    return (yoe + era * 400 + (m <= 2), m, d)
+
+def csv_lines(columns):
+    '''
+    Joins (rows, width) character matrices of the fields into csv lines
+    '''
+    rows = len(columns[0])
+    parts = []
+    for column in columns:
+        parts.append(column)
+        parts.append(constant(",", rows))
+    parts[-1] = constant("\n", rows)
+    return np.hstack(parts).tobytes()
+
+def write_file(filename, ticker, rows, tick_mode, rng):
+    '''
+    Writes Finam-style csv file of 'rows' random ticks or 1 minute bars of 'ticker'
+    '''
+    with open(filename, 'wb') as f:
+        if tick_mode:
+            f.write(b"<TICKER>,<PER>,<DATE>,<TIME>,<LAST>,<VOL>\n")
+        else:
+            f.write(b"<TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>\n")
+        last_time = utils.datetime_to_epoch(_START)
+        price = 50000
+        for first in range(0, rows, _BLOCK_ROWS):
+            n = min(_BLOCK_ROWS, rows - first)
+            if tick_mode:
+                times = last_time + np.cumsum(rng.integers(0, 3, n))
+            else:
+                times = last_time + _BAR_SECONDS * np.arange(1, n + 1)
+            last_time = int(times[-1])
+            prices = np.clip(price + np.cumsum(rng.integers(-5, 6, n)), 10000, 99999)
+            price = int(prices[-1])
+
+            (y, m, d) = civil_from_days(times // 86400)
+            seconds = times % 86400
+            columns = [constant(ticker, n), constant("0" if tick_mode else "1", n),
+                       digits(y * 10000 + m * 100 + d, 8),
+                       digits(seconds // 3600 * 10000 + seconds // 60 % 60 * 100 + seconds % 60, 6)]
+            if tick_mode:
+                columns.append(price_text(prices))
+            else:
+                spread = rng.integers(0, 20, (3, n))
+                columns += [price_text(prices), price_text(np.minimum(prices + spread[0], 99999)),
+                            price_text(np.maximum(prices - spread[1], 10000)),
+                            price_text(np.clip(prices + spread[2] - 10, 10000, 99999))]
+            columns.append(digits(rng.integers(1, 10000, n), 4))
+            f.write(csv_lines(columns))
+
+def generate(directory, rows, tickers, tick_mode, seed=0):
+    '''
+    Writes 'rows' rows split between 'tickers' files, returns their names
+    '''
+    rng = np.random.default_rng(seed)
+    filenames = []
+    for i in range(0, tickers):
+        ticker = "T%03d" % i
+        filename = os.path.join(directory, ticker + ("_ticks.txt" if tick_mode else "_bars.txt"))
+        write_file(filename, ticker, rows // tickers + (1 if i < rows % tickers else 0), tick_mode, rng)
+        filenames.append(filename)
+    return filenames
+
+def percentiles(values):
+    values = np.sort(np.array(values)) * 1000
+    return {"p50-ms" : float(np.percentile(values, 50)), "p90-ms" : float(np.percentile(values, 90)),
+            "p99-ms" : float(np.percentile(values, 99)), "max-ms" : float(values[-1])}
+
+def bench_load(filenames):
+    loader = csvloader.CsvQuoteLoader()
+    start = time.perf_counter()
+    loaded = [loader.load(filename) for filename in filenames]
+    elapsed = time.perf_counter() - start
+    rows = sum(quotes.total_candles() for quotes in loaded)
+    size = sum(os.path.getsize(filename) for filename in filenames)
+    return (loaded, {"seconds" : elapsed, "rows" : rows, "rows-per-sec" : rows / elapsed, "mb-per-sec" : size / elapsed / 1e6})
+
+def bench_naive_delta(loaded):
+    ticks = [np.array(quotes.data) for quotes in loaded if quotes.tick_mode]
+    start = time.perf_counter()
+    for data in ticks:
+        csvloader.naive_delta(data)
+    elapsed = time.perf_counter() - start
+    items = sum(len(data) for data in ticks)
+    return {"seconds" : elapsed, "items-per-sec" : items / elapsed}
+
+def bench_serialize(loaded):
+    start = time.perf_counter()
+    for quotes in loaded:
+        wire.pack(quotes.data, quotes.tick_mode, quotes.period())
+    elapsed = time.perf_counter() - start
+    items = sum(quotes.total_candles() for quotes in loaded)
+    return {"seconds" : elapsed, "items-per-sec" : items / elapsed}
+
+def bench_merge(filenames, loaded, max_items):
+    for quotes in loaded:
+        quotes.packets()
+    stream = QuoteStream(filenames, None, None, {'naive-delta' : False}, loaded=loaded)
+    items = 0
+    start = time.perf_counter()
+    while True:
+        item = stream.next_packets(max_items)
+        if item is None:
+            break
+        items += max(item[2], 1)
+    elapsed = time.perf_counter() - start
+    return {"seconds" : elapsed, "items" : items, "items-per-sec" : items / elapsed}
+
+def bench_stream(filenames, items, batch, latency_samples):
+    '''
+    Streams 'items' items through EventLoop to a DEALER client over inproc, then measures
+    round trips of a single credit
+    '''
+    ctx = zmq.Context.instance()
+    endpoint = "inproc://benchmark-%d" % os.getpid()
+    loop = EventLoop(ctx, endpoint, "BENCH", {'naive-delta' : False, 'cache-size' : 0})
+    loop.start()
+    client = ctx.socket(zmq.DEALER)
+    client.setsockopt(zmq.RCVTIMEO, 60000)
+    client.connect(endpoint)
+    try:
+        client.send_multipart([b'', b'\x01', json.dumps({"command" : "start", "src" : filenames, "batch" : batch}).encode('utf-8')])
+        response = json.loads(client.recv_multipart()[2].decode('utf-8'))
+        if response["result"] != "success":
+            raise Exception("Unable to start stream: " + str(response))
+
+        window = 1000
+        client.send_multipart([b'', b'\x03', struct.pack("<I", window)])
+        received = 0
+        unacknowledged = 0
+        start = time.perf_counter()
+        while received < items:
+            packet = client.recv_multipart()
+            count = struct.unpack_from("<II", packet[3])[1] if batch > 0 else 1
+            received += count
+            unacknowledged += count
+            if unacknowledged >= window // 2:
+                client.send_multipart([b'', b'\x03', struct.pack("<I", unacknowledged)])
+                unacknowledged = 0
+        elapsed = time.perf_counter() - start
+
+        # Drain credit that is still outstanding, so that each sample waits for exactly one packet
+        while client.poll(200):
+            client.recv_multipart()
+        latencies = []
+        for _ in range(0, latency_samples):
+            sent = time.perf_counter()
+            client.send_multipart([b'', b'\x03', struct.pack("<I", 1)])
+            client.recv_multipart()
+            latencies.append(time.perf_counter() - sent)
+    finally:
+        client.close(linger=0)
+        loop.stop()
+
+    result = {"seconds" : elapsed, "items" : received, "items-per-sec" : received / elapsed}
+    result["credit-round-trip"] = percentiles(latencies)
+    return result
+
+def run(directory, rows, tickers, tick_mode, stream_items, latency_samples):
+    start = time.perf_counter()
+    filenames = generate(directory, rows, tickers, tick_mode)
+    results = {"generate-seconds" : time.perf_counter() - start}
+    (loaded, results["load"]) = bench_load(filenames)
+    if tick_mode:
+        results["naive-delta"] = bench_naive_delta(loaded)
+    results["serialize"] = bench_serialize(loaded)
+    results["merge"] = bench_merge(filenames, loaded, 1)
+    results["merge-batch-256"] = bench_merge(filenames, loaded, 256)
+    # Items of the stream that are left over for latency samples and credit that is still outstanding
+    stream_items = max(0, min(stream_items, rows - latency_samples - 2000))
+    results["stream"] = bench_stream(filenames, stream_items, 0, latency_samples)
+    results["stream-batch-256"] = bench_stream(filenames, stream_items, 256, latency_samples)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures load, merge, serialization and streaming throughput on synthetic csv-files')
+    parser.add_argument('--rows', type=int, default=1000000, help='Total number of rows of generated files of each kind')
+    parser.add_argument('--tickers', type=int, default=1, help='Number of tickers, each in its own file')
+    parser.add_argument('--kind', choices=['ticks', 'bars', 'both'], default='both', help='Kind of generated files')
+    parser.add_argument('--stream-items', type=int, default=1000000, help='Maximum number of items streamed through the event loop')
+    parser.add_argument('--latency-samples', type=int, default=1000, help='Number of single-credit round trips measured')
+    parser.add_argument('--data-dir', help='Directory for generated files, a temporary one that is removed afterwards by default')
+    parser.add_argument('--output', help='Writes JSON results to the file instead of standard output')
+
+    args = parser.parse_args()
+    if args.rows < args.tickers or args.tickers < 1:
+        parser.error('--rows should be at least --tickers, and --tickers at least 1')
+
+    directory = args.data_dir or tempfile.mkdtemp(prefix="quotesource-benchmark-")
+    os.makedirs(directory, exist_ok=True)
+    report = {"rows" : args.rows, "tickers" : args.tickers, "results" : {}}
+    try:
+        for kind in (['ticks', 'bars'] if args.kind == 'both' else [args.kind]):
+            report["results"][kind] = run(directory, args.rows, args.tickers, kind == 'ticks', args.stream_items, args.latency_samples)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(directory)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
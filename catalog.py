@@ -0,0 +1,144 @@
+'''
+
+'''
+
+import json
+import os
+import threading
+import time
+import csvloader
+import quotes as li
+import utils
+
+VERSION = 1
+FILENAME = ".quotesource-catalog.json"
+
+def scan(path):
+    '''
+    Reads file once without parsing its rows, returns its catalog entry, or None if it is not a quotes file
+    '''
+    with csvloader.CsvInput(path, 1 << 24) as csv_input:
+        parser = csvloader.CsvParser(csv_input.header)
+        if parser.is_ambiguous():
+            return None
+        (first, last, rows) = (None, None, 0)
+        for block in csv_input.blocks:
+            block = block.rstrip(b'\r\n')
+            if not block:
+                continue
+            if first is None:
+                first = block[:block.find(b'\n')] if b'\n' in block else block
+            last = block[block.rfind(b'\n') + 1:]
+            rows += block.count(b'\n') + 1
+    entry = {"ticker" : None, "per" : None, "ticks" : parser.tick_mode, "first" : None, "last" : None, "rows" : rows}
+    if rows > 0:
+        # Both lines go through the parser, which checks them and takes ticker and period of the file
+        data = parser.parse(first + b'\n' + last)
+        entry.update({"ticker" : parser.code, "per" : parser.per_id, "first" : int(data['time'][0]), "last" : int(data['time'][1])})
+    return entry
+
+def entry_period(entry):
+    '''
+    Seconds per item of catalog entry: 0 for ticks, None for bars of unknown interval
+    '''
+    if entry["ticks"]:
+        return 0
+    interval = li.interval_by_short_id(entry["per"])
+    return li.interval_info(interval).delta.total_seconds() if interval is not None else None
+
+class Catalog:
+    '''
+    Index of quotes files under 'root' with their ticker, period, first and last timestamp and number of rows,
+    kept in 'path' between runs. Files are rescanned only when their mtime or size changes, at most every 'max_age' seconds
+    '''
+    def __init__(self, root, path=None, max_age=10):
+        self.root = root
+        self.path = path or os.path.join(root, FILENAME)
+        self.max_age = max_age
+        self.entries = {}
+        self.refreshed = None
+        self.loader = csvloader.CsvQuoteLoader()
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            if index.get("version") == VERSION:
+                self.entries = index["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def refresh(self):
+        '''
+        Scans files that were added or changed since the last refresh and drops removed ones, saving the index if anything changed
+        '''
+        with self.lock:
+            seen = set()
+            changed = False
+            for (directory, _, names) in os.walk(self.root):
+                for name in sorted(names):
+                    path = os.path.join(directory, name)
+                    if name == FILENAME or not self.loader.probe(path):
+                        continue
+                    relative = os.path.relpath(path, self.root)
+                    seen.add(relative)
+                    try:
+                        stat = os.stat(path)
+                        entry = self.entries.get(relative)
+                        if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                            continue
+                        entry = scan(path)
+                    except Exception as e:
+                        print("Error: unable to scan file:", path, e)
+                        entry = None
+                    if entry is None:
+                        changed |= self.entries.pop(relative, None) is not None
+                        seen.discard(relative)
+                        continue
+                    entry.update({"mtime" : stat.st_mtime_ns, "size" : stat.st_size})
+                    self.entries[relative] = entry
+                    changed = True
+            for relative in [k for k in self.entries if k not in seen]:
+                del self.entries[relative]
+                changed = True
+            if changed:
+                self.save()
+            self.refreshed = time.monotonic()
+
+    def save(self):
+        tmp_path = self.path + "." + str(os.getpid()) + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"version" : VERSION, "files" : self.entries}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Error: unable to save catalog:", e)
+
+    def find(self, tickers, interval=None, from_time=None, to_time=None):
+        '''
+        Files of 'tickers' that have items between 'from_time' and 'to_time' (datetimes), ordered by ticker and time.
+        For each ticker files of 'interval' are taken if there are any, otherwise the coarsest data that can be
+        resampled to it; without 'interval' the finest data is taken
+        '''
+        if self.refreshed is None or time.monotonic() - self.refreshed > self.max_age:
+            self.refresh()
+        from_epoch = utils.datetime_to_epoch(from_time) if from_time else None
+        to_epoch = utils.datetime_to_epoch(to_time) if to_time else None
+        target = li.interval_info(interval).delta.total_seconds() if interval is not None else None
+        result = []
+        with self.lock:
+            for ticker in tickers:
+                candidates = [(relative, entry) for (relative, entry) in self.entries.items()
+                              if entry["ticker"] == ticker and entry["rows"] > 0 and
+                              (from_epoch is None or entry["last"] >= from_epoch) and (to_epoch is None or entry["first"] <= to_epoch)]
+                periods = set(entry_period(entry) for (_, entry) in candidates)
+                if target is None:
+                    known = [p for p in periods if p is not None]
+                    period = min(known) if known else None
+                elif target == 0:
+                    period = 0 if 0 in periods else -1
+                else:
+                    usable = [p for p in periods if p is not None and (p == 0 or (p <= target and target % p == 0))]
+                    period = max(usable) if usable else -1
+                chosen = [(entry["first"], relative) for (relative, entry) in candidates if entry_period(entry) == period]
+                result.extend(os.path.join(self.root, relative) for (_, relative) in sorted(chosen))
+        return result
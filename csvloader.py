@@ -2,103 +2,223 @@
 import quotes as li
 import datetime
 import csv
+import bz2
+import gzip
+import lzma
+import numpy as np
+import os
+import queue
+import threading
+import zipfile
+import sidecar
+
+# Zero bytes after the end of parsed block, so that fields can be gathered as fixed-width windows without copying the block
+_PADDING = 32
+_MONTH_DAYS = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+# Compressed files are opened by extension; zip archives hold one csv file per member
+_DECOMPRESSORS = {".gz" : gzip.open, ".bz2" : bz2.open, ".xz" : lzma.open}
+_ARCHIVE = ".zip"
+_PRICE_DIGITS = len(str(li.PRICE_SCALE)) - 1
+_POWERS = 10 ** np.arange(19, dtype=np.int64)
+
+class CsvParser:
+    '''
+    Converts lines of Finam-style csv file to records of quotes.TICK_DTYPE or quotes.CANDLE_DTYPE.
+    Lines are converted in batches, column by column, and the parser remembers ticker and period
+    of the first batch to reject files with mixed tickers
+    '''
+    def __init__(self, header):
+        columns = next(csv.reader([header]))
+        self.width = len(columns)
+        self.col_ticker = columns.index("<TICKER>")
+        self.col_per = None
+        if "<PER>" in columns:
+            self.col_per = columns.index("<PER>")
+        self.col_date = columns.index("<DATE>")
+        self.col_time = columns.index("<TIME>")
+        self.col_last = None
+        if "<LAST>" in columns:
+            self.col_last = columns.index("<LAST>")
+        self.col_open = None
+        if all(c in columns for c in ("<OPEN>", "<HIGH>", "<LOW>", "<CLOSE>")):
+            self.col_open = columns.index("<OPEN>")
+            self.col_high = columns.index("<HIGH>")
+            self.col_low = columns.index("<LOW>")
+            self.col_close = columns.index("<CLOSE>")
+        self.col_volume = columns.index("<VOL>")
+
+        self.tick_mode = self.col_last is not None
+        self.dtype = li.TICK_DTYPE if self.tick_mode else li.CANDLE_DTYPE
+        self.code = None
+        self.per_id = None
+
+    def is_ambiguous(self):
+        return self.tick_mode and self.col_open is not None
+
+    def parse(self, block):
+        '''
+        Parses a block of whole lines of the file (bytes, without the header)
+        '''
+        block = block.replace(b'\r', b'').rstrip(b'\n')
+        if not block:
+            return np.empty(0, dtype=self.dtype)
+        buf = np.frombuffer(block + b'\n' + bytes(_PADDING), dtype=np.uint8)
+        separators = np.flatnonzero((buf == 44) | (buf == 10))
+        rows = int(np.count_nonzero(buf == 10))
+        if len(separators) != rows * self.width or (buf[separators[self.width - 1::self.width]] != 10).any():
+            raise Exception("Invalid csv file: all rows should have " + str(self.width) + " columns")
+        ends = separators.reshape(rows, self.width)
+        starts = np.empty_like(ends)
+        starts.flat[0] = 0
+        starts.flat[1:] = separators[:-1] + 1
+        field = lambda col: (buf, starts[:, col], ends[:, col])
+
+        if self.code is None:
+            self.code = field_text(buf, starts[0, self.col_ticker], ends[0, self.col_ticker])
+        if not fields_equal(*field(self.col_ticker), self.code):
+            raise Exception("Mixed tickers in file: not supported")
+
+        if self.col_per is not None:
+            if self.per_id is None:
+                self.per_id = field_text(buf, starts[0, self.col_per], ends[0, self.col_per])
+            if not fields_equal(*field(self.col_per), self.per_id):
+                raise Exception("Mixed tickers in file: not supported")
+
+        data = np.empty(rows, dtype=self.dtype)
+        data['time'] = parse_times(field(self.col_date), field(self.col_time))
+        if self.tick_mode:
+            data['price'] = parse_prices(*field(self.col_last))
+        else:
+            data['open'] = parse_prices(*field(self.col_open))
+            data['high'] = parse_prices(*field(self.col_high))
+            data['low'] = parse_prices(*field(self.col_low))
+            data['close'] = parse_prices(*field(self.col_close))
+        data['volume'] = parse_decimals(*field(self.col_volume), 0)
+        return data
+
+def load_file(source, naive_delta=False, sidecars=False):
+    '''
+    Loads 'source' with a new CsvQuoteLoader, for use in loader processes
+    '''
+    return CsvQuoteLoader(naive_delta, sidecars=sidecars).load(source)
+
+def naive_delta(ticks, state=None):
+    '''
+    Signs volumes of 'ticks' in place by the tick rule: upticks are buys, downticks are sells and zero ticks have the side
+    of the last price change. 'state' is (last price, last tick is buy) of the preceding ticks of the same file, None at
+    its start, where ticks before the first price change are buys. Returns the state after 'ticks'
+    '''
+    if len(ticks) == 0:
+        return state
+    prices = ticks['price']
+    (prev_price, prev_buy) = state if state is not None else (prices[0], True)
+    changes = np.sign(np.diff(prices, prepend=prev_price))
+    # Index of the last price change at or before each tick, -1 if there is none yet
+    last_change = np.where(changes != 0, np.arange(len(changes)), -1)
+    np.maximum.accumulate(last_change, out=last_change)
+    buy = np.where(last_change >= 0, changes[last_change] > 0, prev_buy)
+    np.negative(ticks['volume'], out=ticks['volume'], where=~buy)
+    return (int(prices[-1]), bool(buy[-1]))
 
 class CsvQuoteLoader:
-    def __init__(self, naive_delta=False):
+    def __init__(self, naive_delta=False, batch_size=1 << 24, sidecars=False):
         self.id = "csv"
         self.naive_delta = naive_delta
-        self.prev_price = None
-        self.prev_buy = True
+        self.batch_size = batch_size
+        self.sidecars = sidecars
 
     def load(self, source):
-        col_ticker = None
-        col_per = None
-        col_date = None
-        col_last = None
-        col_open = None
-        col_high = None
-        col_low = None
-        col_close = None
-        col_volume = None
-
-        code = None
-        per_id = None
-
-        candles = []
-
-        tick_mode = False
-        with open(source) as f:
-            reader = csv.reader(f)
-            header = reader.__next__()
-            col_ticker = header.index("<TICKER>")
-            try:
-                col_per = header.index("<PER>")
-            except:
-                pass
-            col_date = header.index("<DATE>")
-            col_time = header.index("<TIME>")
-            try:
-                col_last = header.index("<LAST>")
-                tick_mode = True
-            except:
-                pass
-            try:
-                col_open = header.index("<OPEN>")
-                col_high = header.index("<HIGH>")
-                col_low = header.index("<LOW>")
-                col_close = header.index("<CLOSE>")
-                if tick_mode:
-                    return None
-            except:
-                pass
-            col_volume = header.index("<VOL>")
-            for row in reader:
-                if code == None:
-                    code = row[col_ticker]
-                else:
-                    if row[col_ticker] != code: raise Exception("Mixed tickers in file: not supported")
-
-                if per_id == None and col_per:
-                    per_id = row[col_per]
-                else:
-                    if col_per and row[col_per] != per_id: raise Exception("Mixed tickers in file: not supported")
-
-                time = self.parse_time(row[col_date], row[col_time])
-                volume = float(row[col_volume])
-                
-                if not tick_mode:
-                    price_open = float(row[col_open])
-                    price_high = float(row[col_high])
-                    price_low = float(row[col_low])
-                    price_close = float(row[col_close])
-    
-                    candle = li.Candle(time, price_low, price_high, price_open, price_close, volume)
-                    candles.append((time, candle))
-                else:
-                    price = float(row[col_last])
-                    if self.naive_delta:
-                        if self.prev_price is not None:
-                            if price > self.prev_price:
-                                self.prev_buy = True
-                            elif price < self.prev_price:
-                                self.prev_buy = False
-                                volume = -volume
-                            else:
-                                if not self.prev_buy:
-                                    volume = -volume
-                        self.prev_price = price
-                    tick = li.Tick(time, price, volume)
-                    candles.append((time, tick))
-                    
-        q = li.Quotes(code, li.interval_by_short_id(per_id))
-        q.tick_mode = tick_mode
-        q.candles = candles
-        return q
+        quotes = None
+        if self.sidecars:
+            quotes = sidecar.read(source)
+        if quotes is None:
+            stat = os.stat(source)
+            quotes = self.parse(source)
+            if quotes is None:
+                return None
+            if self.sidecars:
+                sidecar.write(source, quotes, stat)
+        return self.derive(quotes)
+
+    def raw(self):
+        '''
+        Loader of the same files without naive delta, whose quotes are turned into quotes of this loader by derive()
+        '''
+        if not self.naive_delta:
+            return self
+        return CsvQuoteLoader(False, self.batch_size, self.sidecars)
+
+    def derive(self, quotes):
+        '''
+        Applies naive delta to quotes of a whole file loaded by raw(), copying their data if it is read-only
+        '''
+        if quotes is None or not quotes.tick_mode or not self.naive_delta:
+            return quotes
+        data = quotes.data if quotes.data.flags.writeable else np.array(quotes.data)
+        naive_delta(data)
+        return li.Quotes(quotes.code, quotes.interval, quotes.tick_mode, data)
+
+    def load_range(self, source, start=None, stop=None):
+        '''
+        Loads rows of 'source' from byte offset 'start' up to 'stop', both at line starts, e.g. taken from offsetindex
+        '''
+        # Sides of ticks are classified from the start of the range
+        return self.derive(self.parse(source, start, stop))
+
+    def parse(self, source, start=None, stop=None):
+        batches = []
+        with CsvInput(source, self.batch_size, start=start, stop=stop) as csv_input:
+            parser = CsvParser(csv_input.header)
+            if parser.is_ambiguous():
+                return None
+            for block in csv_input.blocks:
+                batches.append(parser.parse(block))
+
+        data = np.concatenate(batches) if batches else np.empty(0, dtype=parser.dtype)
+        return li.Quotes(parser.code, li.interval_by_short_id(parser.per_id), parser.tick_mode, data)
+
+    def load_chunks(self, source, chunk_size=1 << 20, start=None, stop=None):
+        '''
+        Returns iterator over consecutive parts of 'source' as quotes.Quotes, reading and parsing
+        about 'chunk_size' bytes of the file at a time, optionally from byte offset 'start' up to 'stop'
+        '''
+        csv_input = CsvInput(source, chunk_size, start=start, stop=stop)
+        try:
+            parser = CsvParser(csv_input.header)
+        except:
+            csv_input.close()
+            raise
+        if parser.is_ambiguous():
+            csv_input.close()
+            return None
+        return self._iter_chunks(csv_input, parser)
+
+    def _iter_chunks(self, csv_input, parser):
+        with csv_input:
+            empty = True
+            state = None
+            for block in csv_input.blocks:
+                data = parser.parse(block)
+                if parser.tick_mode and self.naive_delta:
+                    state = naive_delta(data, state)
+                empty = False
+                yield li.Quotes(parser.code, li.interval_by_short_id(parser.per_id), parser.tick_mode, data)
+            if empty:
+                yield li.Quotes(parser.code, li.interval_by_short_id(parser.per_id), parser.tick_mode)
+
+    def settings(self):
+        '''
+        Loader options that affect loaded data
+        '''
+        return (self.id, self.naive_delta)
 
     def probe(self, source):
-        ext = source[-3:].lower()
-        print("CsvLoader: ext", ext)
-        return ext == "csv" or ext == "txt"
+        (name, ext) = os.path.splitext(source.lower())
+        if ext == _ARCHIVE:
+            return True
+        if ext in _DECOMPRESSORS:
+            ext = os.path.splitext(name)[1]
+        return ext == ".csv" or ext == ".txt"
 
     def parse_time(self, date, time):
         if len(date) != 8:
@@ -115,3 +235,248 @@ class CsvQuoteLoader:
 
         return datetime.datetime(y, m, d, hour, minutes, sec)
 
+def is_compressed(source):
+    ext = os.path.splitext(source)[1].lower()
+    return ext in _DECOMPRESSORS or ext == _ARCHIVE
+
+class CsvInput:
+    '''
+    Header and blocks of whole lines of csv file 'source', which may be compressed with gzip, bzip2 or xz (by extension),
+    or be a zip archive of csv files with the same header, read one after another. Compressed input is decompressed
+    in a background thread, so that decompression overlaps with parsing. Plain files can be read from byte offset 'start'
+    up to 'stop', which should be at line starts
+    '''
+    def __init__(self, source, block_size, depth=2, start=None, stop=None):
+        self.archive = None
+        self.limit = None
+        ext = os.path.splitext(source)[1].lower()
+        if (start is not None or stop is not None) and is_compressed(source):
+            raise Exception("Compressed file can not be read from an offset: " + source)
+        if ext == _ARCHIVE:
+            self.archive = zipfile.ZipFile(source)
+            names = [info.filename for info in self.archive.infolist() if not info.is_dir()]
+            if not names:
+                self.archive.close()
+                raise Exception("Empty zip archive: " + source)
+            self.files = (self.archive.open(name) for name in names)
+        elif ext in _DECOMPRESSORS:
+            self.files = iter([_DECOMPRESSORS[ext](source, 'rb')])
+        else:
+            self.files = iter([open(source, 'rb')])
+        self.file = next(self.files)
+        try:
+            self.header_line = self.file.readline()
+        except:
+            self._close_files()
+            raise
+        self.header = self.header_line.decode('utf-8')
+        if start is not None and start > len(self.header_line):
+            self.file.seek(start)
+        if stop is not None:
+            self.limit = stop - self.file.tell()
+        self.blocks = self._read(block_size)
+        if self.archive is not None or ext in _DECOMPRESSORS:
+            self.blocks = ReadAhead(self.blocks, depth)
+
+    def _read(self, block_size):
+        try:
+            while self.file is not None:
+                yield from read_blocks(self.file, block_size, self.limit)
+                self.file.close()
+                self.file = next(self.files, None)
+                if self.file is not None and self.file.readline() != self.header_line:
+                    raise Exception("Invalid zip archive: all members should have the same csv header")
+        finally:
+            self._close_files()
+
+    def _close_files(self):
+        if self.file is not None:
+            self.file.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def close(self):
+        self.blocks.close()
+        # Files of a background reader are closed by its thread, as it may be reading them
+        if not isinstance(self.blocks, ReadAhead):
+            self._close_files()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ReadAhead:
+    '''
+    Iterates over 'chunks' in a background thread, keeping at most 'depth' items ready ahead of the consumer.
+    If given, 'prepare' is called for each item in the background thread as well
+    '''
+    def __init__(self, chunks, depth=2, prepare=None):
+        self.queue = queue.Queue(depth)
+        self.prepare = prepare
+        self.stopped = threading.Event()
+        self.done = False
+        self.thread = threading.Thread(target=self._run, args=(chunks,), daemon=True)
+        self.thread.start()
+
+    def _run(self, chunks):
+        try:
+            for chunk in chunks:
+                if self.prepare is not None:
+                    self.prepare(chunk)
+                if not self._put((chunk, None)):
+                    return
+            self._put((None, None))
+        except Exception as e:
+            self._put((None, e))
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        (chunk, error) = self.queue.get()
+        if chunk is None:
+            self.done = True
+            if error is not None:
+                raise error
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        self.done = True
+        self.stopped.set()
+
+def read_blocks(f, size, limit=None):
+    '''
+    Reads binary file in blocks of approximately given size, each ending at a line boundary, up to 'limit' bytes if given
+    '''
+    rest = b''
+    while True:
+        if limit is not None:
+            chunk = f.read(min(size, limit)) if limit > 0 else b''
+            limit -= len(chunk)
+        else:
+            chunk = f.read(size)
+        if not chunk:
+            if rest:
+                yield rest
+            return
+        chunk = rest + chunk
+        cut = chunk.rfind(b'\n') + 1
+        rest = chunk[cut:]
+        if cut > 0:
+            yield chunk[:cut]
+
+def field_text(buf, start, end):
+    return buf[start:end].tobytes().decode('utf-8')
+
+def field_chars(buf, starts, ends, width):
+    '''
+    Gathers fields into (rows, width) matrix of characters, padded with zeros
+    '''
+    if len(starts) and starts.max() + width > len(buf):
+        buf = np.concatenate((buf, np.zeros(width, dtype=np.uint8)))
+    chars = np.lib.stride_tricks.sliding_window_view(buf, width)[starts]
+    chars[np.arange(width) >= (ends - starts)[:, None]] = 0
+    return chars
+
+def fields_equal(buf, starts, ends, text):
+    value = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+    if (ends - starts != len(value)).any():
+        return False
+    return bool((field_chars(buf, starts, ends, len(value)) == value).all())
+
+def parse_digits(buf, starts, ends, width, description):
+    '''
+    Converts fields of exactly 'width' decimal digits to integers
+    '''
+    digits = field_chars(buf, starts, ends, width).astype(np.int64) - 48
+    bad = (ends - starts != width) | ((digits < 0) | (digits > 9)).any(axis=1)
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise Exception("Invalid " + description + ", have: " + field_text(buf, starts[i], ends[i]))
+    return digits @ (10 ** np.arange(width - 1, -1, -1, dtype=np.int64))
+
+def parse_times(date_field, time_field):
+    '''
+    Converts fields of YYYYMMDD dates and HHMMSS times to epoch seconds
+    '''
+    d = parse_digits(*date_field, 8, "date format: should be YYYYMMDD")
+    t = parse_digits(*time_field, 6, "time format: should be HHMMSS")
+    (y, m, d) = (d // 10000, d // 100 % 100, d % 100)
+    (hour, minutes, sec) = (t // 10000, t // 100 % 100, t % 100)
+
+    leap = (y % 4 == 0) & ((y % 100 != 0) | (y % 400 == 0))
+    month_days = _MONTH_DAYS[np.clip(m, 0, 12)] + (leap & (m == 2))
+    bad = (m < 1) | (m > 12) | (d < 1) | (d > month_days) | (hour > 23) | (minutes > 59) | (sec > 59)
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise Exception("Invalid date/time: " + field_text(*date_field[0:1], date_field[1][i], date_field[2][i]) +
+                        " " + field_text(*time_field[0:1], time_field[1][i], time_field[2][i]))
+
+    return days_from_civil(y, m, d) * 86400 + hour * 3600 + minutes * 60 + sec
+
+def days_from_civil(y, m, d):
+    '''
+    Number of days since 1970-01-01 for arrays of proleptic Gregorian dates
+    '''
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + np.where(m > 2, -3, 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def parse_decimals(buf, starts, ends, scale):
+    '''
+    Converts fields of plain decimal numbers ('-123.45') exactly to integers in units of 10 ** -'scale',
+    rounding fraction digits beyond 'scale' half away from zero
+    '''
+    lengths = ends - starts
+    width = max(int(lengths.max()), 1)
+    chars = field_chars(buf, starts, ends, width)
+    negative = chars[:, 0] == 45
+    chars[:, 0] = np.where(negative | (chars[:, 0] == 43), 0, chars[:, 0])
+    is_digit = (chars >= 48) & (chars <= 57)
+    is_dot = chars == 46
+    digit_count = np.count_nonzero(is_digit, axis=1)
+    fraction_digits = np.where(is_dot.any(axis=1), lengths - 1 - is_dot.argmax(axis=1), 0)
+    bad = (~(is_digit | is_dot | (chars == 0))).any(axis=1) | (np.count_nonzero(is_dot, axis=1) > 1) | (digit_count == 0) | (digit_count > 18)
+    # Integer part has to fit int64 once scaled
+    bad |= digit_count - fraction_digits + scale > 18
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise Exception("Invalid number: " + field_text(buf, starts[i], ends[i]))
+
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    for j in range(0, width):
+        mantissa = np.where(is_digit[:, j], mantissa * 10 + (chars[:, j].astype(np.int64) - 48), mantissa)
+    shift = scale - fraction_digits
+    values = mantissa * _POWERS[np.clip(shift, 0, 18)]
+    rounded = shift < 0
+    if rounded.any():
+        divisor = _POWERS[np.clip(-shift, 0, 18)]
+        (quotient, remainder) = np.divmod(mantissa, divisor)
+        values = np.where(rounded, quotient + (2 * remainder >= divisor), values)
+    return np.where(negative, -values, values)
+
+def parse_prices(buf, starts, ends):
+    '''
+    Converts price fields to fixed-point integers (see quotes.PRICE_SCALE) without going through floats
+    '''
+    return parse_decimals(buf, starts, ends, _PRICE_DIGITS)
@@ -2,6 +2,9 @@
 '''
 
 import zmq
+import catalog
+import concurrent.futures
+import multiprocessing
 import threading
 import struct
 import random
@@ -11,6 +14,23 @@ import re
 import utils
 import quotes as li
 import json
+import time
+import heapq
+import numpy as np
+import offsetindex
+import os
+import profiler
+import quotecache
+import resample
+import sidecar
+import wire
+
+_SNDMORE = int(zmq.SNDMORE)
+_NOBLOCK = int(zmq.NOBLOCK)
+# Poll timeout while some peer does not read its data fast enough, as there is no way to poll for a single peer becoming writable
+_BLOCKED_POLL_MS = 5
+# Poll timeout while sources of some stream are being loaded by loader processes
+_LOADING_POLL_MS = 10
 
 class EventloopError(Exception):
     def __init__(self, value):
@@ -19,83 +39,410 @@ class EventloopError(Exception):
     def __str__(self):
         return repr(self.value)
 
+def file_window(file, from_time, to_time, interval, config, build=True):
+    '''
+    Returns (start, stop) byte offsets of the part of 'file' with its items between epoch 'from_time' and 'to_time',
+    found in offset index of the file, or None if the whole file has to be read. Without 'build' only an existing index is used
+    '''
+    if not config.get('offset-index', False) or (from_time is None and to_time is None) or csvloader.is_compressed(file):
+        return None
+    rows = config.get('index-rows', offsetindex.DEFAULT_ROWS)
+    entries = offsetindex.get(file, rows) if build else offsetindex.read(file, rows)
+    if entries is None:
+        return None
+    if to_time is not None and interval is not None:
+        # Bar that starts at 'to' is built from items up to the end of its period
+        to_time += li.interval_info(interval).delta.total_seconds()
+    window = offsetindex.window(entries, from_time, to_time)
+    return window if window != (None, None) else None
+
 class QuoteStream():
-    def __init__(self, filenames, from_time, to_time, config):
-        self.quotes = []
-        loader = csvloader.CsvQuoteLoader(config['naive-delta'])
-        for file in filenames:
+    def __init__(self, filenames, from_time, to_time, config, cache=None, lazy=False, loaded=None, interval=None, position=None):
+        # Every source is an iterator over consecutive chunks of its quotes: a single chunk for files
+        # loaded up front, or chunks parsed on demand in lazy mode. Files may be already loaded by the caller,
+        # 'loaded' has their quotes.Quotes, or None for files to load here. With 'interval', ticks and bars
+        # of the files are resampled to bars of that interval. With 'offset-index', files that are not cached
+        # are read only from the part that holds the requested time window. With 'position', a token
+        # returned by position() of a stream of the same files, the stream resumes right after that position
+        self.sources = []
+        self.readers = []
+        self.filenames = list(filenames)
+        self.from_time = utils.datetime_to_epoch(from_time) if from_time else None
+        self.to_time = utils.datetime_to_epoch(to_time) if to_time else None
+        # Position of the last item taken from the stream: (timestamp, source, number of items of the source with that
+        # timestamp taken so far, sources whose end-of-stream marker was taken). Merge order is by timestamp and source
+        # index, so sources before it took all of their items with the timestamp and sources after it took none
+        self.taken = (None, None, 0, frozenset())
+        # Position before the last run taken, and position of the items sent so far, which the event loop sets
+        # while items taken after it wait to be sent
+        self.previous = self.taken
+        self.unsent = None
+        if position is not None:
+            self.taken = self._parsePosition(position)
+        last_time = self.taken[0]
+        if last_time is not None:
+            # Items before the position are never read, thanks to offset index and binary search of the time window
+            self.from_time = max(self.from_time or last_time, last_time)
+        windowed = config.get('offset-index', False) and (self.from_time is not None or self.to_time is not None)
+        for (i, file) in enumerate(filenames):
             try:
-                self.quotes.append(loader.load(file))
+                loader = csvloader.CsvQuoteLoader(config['naive-delta'], sidecars=config.get('sidecars', False))
+                quotes = loaded[i] if loaded is not None else None
+                partial = False
+                if quotes is None and (lazy or windowed) and cache is not None and interval is not None:
+                    quotes = cache.peek(loader, file, interval)
+                if quotes is None and (lazy or windowed) and cache is not None:
+                    quotes = cache.peek(loader, file)
+                window = None
+                if quotes is None and (lazy or windowed) and not (loader.sidecars and sidecar.read(file) is not None):
+                    window = file_window(file, self.from_time, self.to_time, interval, config)
+                    if not lazy and window is not None:
+                        # Part of the file is not cached, as other streams may need other parts of it
+                        quotes = loader.load_range(file, *window)
+                        partial = True
+                if quotes is None and lazy and not (loader.sidecars and sidecar.read(file) is not None):
+                    chunks = loader.load_chunks(file, config.get('chunk-size', 1 << 20), *(window or (None, None)))
+                    if chunks is None:
+                        raise EventloopError("Unable to load file: " + file)
+                    if interval is not None:
+                        chunks = resample.resample_chunks(chunks, interval)
+                    reader = csvloader.ReadAhead(chunks, config.get('read-ahead', 2), li.Quotes.packets)
+                    self.readers.append(reader)
+                    self.sources.append(reader)
+                    continue
+                if quotes is None:
+                    quotes = cache.get(loader, file, interval) if cache is not None else loader.load(file)
+                if quotes is None:
+                    raise EventloopError("Unable to load file: " + file)
+                if interval is not None:
+                    if cache is not None and not partial:
+                        quotes = cache.resample(loader, file, quotes, interval)
+                    else:
+                        quotes = resample.resample(quotes, interval)
+                self.sources.append(iter([quotes]))
             except FileNotFoundError:
+                self.close()
                 raise EventloopError("File not found: " + file)
+            except ValueError as e:
+                self.close()
+                raise EventloopError("Unable to resample file: " + file + ": " + str(e))
+            except EventloopError:
+                self.close()
+                raise
         
-        self.indices = [0] * len(filenames)
-        self.from_time = from_time
-        self.to_time = to_time
+        # Current chunk of each source, read from indices[i] up to stops[i]
+        self.quotes = [None] * len(self.sources)
+        self.indices = [0] * len(self.sources)
+        self.stops = [0] * len(self.sources)
+        self.periods = [0] * len(self.sources)
+        # Number of items of each source in the chunks before the current one
+        self.offsets = [0] * len(self.sources)
+        # Merge state: heap of (next timestamp, source index) for sources that have data left,
+        # and heap of indices of exhausted sources that still have to emit end-of-stream marker
+        self.heap = []
+        self.finished = []
+        # Set when a source fails to parse in the middle of the stream, which ends the stream with an error instead of end-of-stream markers
+        self.error = None
+        for i in range(0, len(self.sources)):
+            has_items = self._next_chunk(i)
+            if self.error is not None or self.quotes[i] is None:
+                self.close()
+                raise EventloopError(self.error or "Unable to load file: " + filenames[i])
+            (last_time, last_source, last_count, ended) = self.taken
+            if has_items and last_time is not None and i <= last_source:
+                has_items = self._skip_taken(i, last_time, last_count if i == last_source else None)
+            if has_items:
+                self.heap.append((int(self.quotes[i].times[self.indices[i]]), i))
+            elif i not in ended:
+                self.finished.append(i)
+        heapq.heapify(self.heap)
         self.credit = 0
+        # Item that was taken from the stream, but could not be sent yet because the peer's queue was full
+        self.pending = None
+        self.batch = 0
+        self.ticker_frames = {}
+        self.pacer = None
+        self.deadline = None
+        # Counters for stats command
+        self.started = time.monotonic()
+        self.load_seconds = 0
+        self.items_sent = 0
+        self.bytes_sent = 0
             
-    def next(self):
+    def peek_time(self):
+        '''
+        Timestamp of the next item, or None if the next one is end-of-stream marker
+        '''
+        if self.finished or not self.heap:
+            return None
+        return self.heap[0][0]
+    
+    def progress(self):
+        '''
+        Returns (file, position, total) of every source, with total of None for sources that are parsed in chunks
+        '''
+        result = []
+        for (i, file) in enumerate(self.filenames):
+            total = None
+            if self.sources[i] not in self.readers and self.quotes[i] is not None:
+                total = self.quotes[i].total_candles()
+            result.append((file, self.offsets[i] + self.indices[i], total))
+        return result
+        
+    def position(self, taken=None):
+        '''
+        Token of the position after items taken from the stream, or after 'taken' position of the stream, which a stream
+        of the same files resumes from
+        '''
+        (last_time, last_source, last_count, ended) = taken or self.taken
+        return {"files" : self.filenames, "time" : last_time, "source" : last_source, "count" : last_count, "ended" : sorted(ended)}
+    
+    def _parsePosition(self, position):
+        try:
+            (files, last_time, source, count, ended) = (position["files"], position["time"], position["source"],
+                                                        position["count"], position["ended"])
+            valid = (files == self.filenames and all(isinstance(i, int) and 0 <= i < len(files) for i in ended) and
+                     ((last_time is None and source is None and count == 0) or
+                      (isinstance(last_time, int) and isinstance(source, int) and 0 <= source < len(files) and isinstance(count, int) and count > 0)))
+        except (TypeError, KeyError):
+            valid = False
+        if not valid:
+            raise EventloopError("Invalid position: it should be returned by 'position' command for a stream of the same files")
+        return (last_time, source, count, frozenset(ended))
+        
+    def _skip_taken(self, source, last_time, count):
+        '''
+        Skips 'count' items of source, or all of them with None, that have the timestamp of the position the stream resumes from.
+        The source is at its first item at or after that timestamp. Returns False when there are no items left
+        '''
         while True:
-            item = self._get_next_item()
-            if not item:
-                return item
-            
-            (_, _, candle_or_tick, _) = item
-            if not candle_or_tick:
-                return item
-            
-            (time, _) = candle_or_tick
-            if self.from_time and time < self.from_time:
-                continue
-            if self.to_time and time > self.to_time:
-                continue
-            
-            return item               
-        
-    def _get_next_item(self):
-        for i in range(0, len(self.indices)):
-            if self.indices[i] >= self.quotes[i].total_candles():
-                ticker = self.quotes[i].code
-                tick_mode = self.quotes[i].tick_mode
-                del self.quotes[i]
-                del self.indices[i]
-                return (tick_mode, ticker, None, 0)
-        
-        if len(self.quotes) == 0:
+            i = self.indices[source]
+            end = i + int(np.searchsorted(self.quotes[source].times[i:self.stops[source]], last_time, 'right'))
+            if count is not None:
+                end = min(end, i + count)
+                count -= end - i
+            self.indices[source] = end
+            if end < self.stops[source]:
+                return True
+            if not self._next_chunk(source):
+                return False
+            if count == 0:
+                return True
+        
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+        
+    def _next_chunk(self, source):
+        '''
+        Moves source to its next chunk that has items between 'from' and 'to'. Returns False when there are no such items left
+        '''
+        try:
+            for quotes in self.sources[source]:
+                if self.quotes[source] is not None:
+                    self.offsets[source] += self.quotes[source].total_candles()
+                self.quotes[source] = quotes
+                self.periods[source] = li.interval_info(quotes.interval).delta.total_seconds() if quotes.interval else 0
+                # Each chunk is read from the first item at or after 'from' up to the last item at or before 'to'
+                start = 0
+                stop = quotes.total_candles()
+                if self.from_time is not None:
+                    start = int(np.searchsorted(quotes.times, self.from_time, 'left'))
+                if self.to_time is not None:
+                    stop = int(np.searchsorted(quotes.times, self.to_time, 'right'))
+                    if stop < quotes.total_candles():
+                        self._drop_source(source)
+                self.indices[source] = start
+                self.stops[source] = stop
+                if start < stop:
+                    return True
+        except Exception as e:
+            print("Error: unable to read source:", e)
+            self.error = "Unable to read source: " + str(e)
+            self._drop_source(source)
+        return False
+    
+    def _drop_source(self, source):
+        if self.sources[source] in self.readers:
+            self.sources[source].close()
+        self.sources[source] = iter(())
+        
+    def next_packets(self, max_items):
+        '''
+        Takes a run of up to 'max_items' consecutive items of one source in merge order. Returns (ticker, packets, count)
+        with wire packets of the items as a slice of Quotes.packets(), packets is None for end-of-stream marker.
+        Returns None when all sources are exhausted
+        '''
+        run = self._next_run(max_items)
+        if run is None:
             return None
+        (source, quotes, start, stop) = run
+        if start is None:
+            return (quotes.code, None, 0)
+        size = quotes.packet_size()
+        return (quotes.code, quotes.packets()[start * size:stop * size], stop - start)
         
-        min_dt = self.quotes[0].get_candle(self.indices[0])[0]
-        min_index = 0
-        for i in range(0, len(self.quotes)):
-            this_dt = self.quotes[i].get_candle(self.indices[i])[0]
-            if min_dt > this_dt:
-                min_dt = this_dt
-                min_index = i
+    def _next_run(self, max_items):
+        '''
+        Takes up to 'max_items' consecutive items of the source at the top of merge heap. Returns (source, quotes, start, stop),
+        with start and stop set to None for end-of-stream marker, or None if all sources are exhausted
+        '''
+        if self.finished:
+            source = heapq.heappop(self.finished)
+            self.previous = self.taken
+            self.taken = self.taken[0:3] + (self.taken[3] | {source},)
+            return (source, self.quotes[source], None, None)
         
-        i = self.indices[min_index]        
-        self.indices[min_index] += 1
+        if not self.heap:
+            return None
+        
+        (first_time, source) = self.heap[0]
+        quotes = self.quotes[source]
+        i = self.indices[source]
+        stop = min(self.stops[source], i + max_items)
+        if stop - i > 1 and len(self.heap) > 1:
+            # The run ends where the next earliest source takes over, keeping lower source index first on equal timestamps
+            (other_time, other_source) = min(self.heap[1:3])
+            side = 'right' if source < other_source else 'left'
+            stop = i + int(np.searchsorted(quotes.times[i:stop], other_time, side))
+        (previous_time, previous_source, count, ended) = self.previous = self.taken
+        last_time = first_time if stop - i == 1 else int(quotes.times[stop - 1])
+        if last_time == previous_time and source == previous_source:
+            count += stop - i
+        elif last_time == first_time:
+            count = stop - i
+        else:
+            count = stop - i - int(np.searchsorted(quotes.times[i:stop], last_time, 'left'))
+        self.taken = (last_time, source, count, ended)
+        self._advance(source, stop)
+        return (source, quotes, i, stop)
         
-        return (self.quotes[min_index].tick_mode, self.quotes[min_index].code,
-                self.quotes[min_index].get_candle(i), li.interval_info(self.quotes[min_index].interval).delta.total_seconds())
+    def _advance(self, source, index):
+        '''
+        Moves source at the top of merge heap to given index
+        '''
+        self.indices[source] = index
+        if index < self.stops[source]:
+            heapq.heapreplace(self.heap, (int(self.quotes[source].times[index]), source))
+        elif self._next_chunk(source):
+            heapq.heapreplace(self.heap, (int(self.quotes[source].times[self.indices[source]]), source))
+        else:
+            heapq.heappop(self.heap)
+            if self.error is None:
+                heapq.heappush(self.finished, source)
                 
 
+class Pacer():
+    '''
+    Replay pacing of a stream: fixed delay between items, and/or item timestamps replayed 'speed' times faster than wall clock
+    '''
+    def __init__(self, delay=0, speed=0):
+        self.delay = delay
+        self.speed = speed
+        self.last_sent = None
+        self.origin = None
+        
+    def due(self, item_time):
+        '''
+        Monotonic clock time when item with given timestamp (None for end-of-stream markers) should be sent
+        '''
+        due = 0
+        if self.delay > 0 and self.last_sent is not None:
+            due = self.last_sent + self.delay
+        if self.speed > 0 and self.origin is not None and item_time is not None:
+            due = max(due, self.origin[0] + (item_time - self.origin[1]) / self.speed)
+        return due
+    
+    def sent(self, now, item_time, due):
+        # Keep fixed delays on schedule unless the stream fell behind by a whole delay, e.g. waiting for credit
+        self.last_sent = due if now - due < self.delay else now
+        if self.origin is None and item_time is not None:
+            self.origin = (now, item_time)
+
+class Session():
+    '''
+    Shared replay of one stream to several peers, its members: items of the stream are taken and serialized once,
+    and each of them is sent to every member. With 'slowest' policy the session advances at the credit of its
+    slowest member, waiting for members whose queue is full. With 'drop' policy it advances as long as some member
+    has credit, and members without credit or room in their queue miss the items. The session starts once
+    'expected' members joined, later members join at its current position
+    '''
+    POLICIES = ("slowest", "drop")
+    
+    def __init__(self, name, key, policy="slowest", expected=1):
+        self.name = name
+        # Files and options of the start command, which members have to repeat
+        self.key = key
+        self.policy = policy
+        self.expected = expected
+        # Stream of the session, None while its files are loaded
+        self.stream = None
+        # Credit of each member, and number of items each member missed with 'drop' policy
+        self.members = {}
+        self.dropped = {}
+        self.started = False
+        # Item that was taken from the stream, and members that did not get it yet
+        self.pending = None
+        self.remaining = []
+        
+    def credit(self):
+        if self.policy == "drop":
+            return max(self.members.values(), default=0)
+        return min(self.members.values(), default=0)
+        
 class EventLoop():
     '''
     Main event loop
     '''
 
 
-    def __init__(self, zeromq_context, control_endpoint, exchange_id, config):
+    def __init__(self, zeromq_context, control_endpoint, exchange_id, config=None, worker=False):
         '''
-        Constructor
+        Constructor. In worker mode the loop connects to control endpoint of workers.WorkerPool
+        instead of binding its own
         '''
         
         self.ctx = zeromq_context
         self.control_endpoint_name = control_endpoint
+        self.worker = worker
         self.exchange_id = exchange_id
         self.streams = {}
+        # Shared replay sessions by name, and session of each of their members
+        self.sessions = {}
+        self.members = {}
         self.stream_delay = 0
+        # Heap of (deadline, sequence number, peer id) of paced streams waiting for their next item
+        self.deadlines = []
+        self.deadline_seq = 0
+        if config is None:
+            config = {'naive-delta' : False}
         self.config = config
+        self.stream_budget = config.get('stream-budget', 256)
+        if self.stream_budget < 1:
+            raise EventloopError("'stream-budget' should be at least 1")
+        self.blocked = False
+        # Event loop iterations and time spent in them, not counting waiting for packets
+        self.iterations = 0
+        self.iteration_seconds = 0
+        self.max_iteration_seconds = 0
+        # Files of start commands are loaded by a pool of 'loader-processes' processes, if it is not 0,
+        # and the streams start when all of their files are loaded
+        self.loader_processes = config.get('loader-processes', 0)
+        self.loaders = None
+        self.loading = {}
+        self.cache = None
+        cache_size = config.get('cache-size', quotecache.DEFAULT_MAX_BYTES)
+        if cache_size > 0:
+            self.cache = quotecache.instance()
+            self.cache.max_bytes = cache_size
+        # Start commands may name tickers instead of files, which are looked up in the catalog of 'data-root'
+        self.catalog = None
+        if config.get('data-root'):
+            self.catalog = catalog.Catalog(config['data-root'], config.get('catalog'), config.get('catalog-refresh', 10))
+        # Running profiler of hot paths and results of the last finished one. With 'profile' the loop is profiled from its start
+        # for 'profile-seconds', or until it stops, and the results are written to that file
+        self.profiler = None
+        self.profile_results = None
         
         self.run = False
         
@@ -106,101 +453,659 @@ class EventLoop():
     def stop(self, timeout=1000):
         if not self.run:
             return
-        self.run = False
-        self.signal = self.ctx.socket(zmq.REQ)
-        self.signal.connect(self.control_endpoint_name)
-        self.signal.send_multipart([b'\x01', json.dumps({"command" : "shutdown"}).encode('utf-8')])
+        # The loop stops when it handles the command, stopping it before could leave the command unsent
+        signal = self.ctx.socket(zmq.REQ)
+        signal.connect(self.control_endpoint_name)
+        # A peer may have shut the loop down meanwhile, leaving nobody to take the command
+        while self.thread.is_alive():
+            try:
+                signal.send_multipart([b'\x01', json.dumps({"command" : "shutdown"}).encode('utf-8')], zmq.NOBLOCK)
+                break
+            except zmq.Again:
+                self.thread.join(0.01)
         self.thread.join(timeout)
+        signal.close(linger=0)
         
     def wait(self):
         self.thread.join()
     
     def eventLoop(self):
-        self.control = self.ctx.socket(zmq.ROUTER)
-        self.control.bind(self.control_endpoint_name)
+        if self.worker:
+            # Pool forwards packets with peer id in front, just as ROUTER socket receives them
+            self.control = self.ctx.socket(zmq.DEALER)
+            self.control.connect(self.control_endpoint_name)
+            self.control.send_multipart([b'', b'ready'])
+        else:
+            self.control = self.ctx.socket(zmq.ROUTER)
+            # Sending to a peer whose queue is full fails instead of silently dropping the data
+            self.control.setsockopt(zmq.ROUTER_MANDATORY, 1)
+            self.control.bind(self.control_endpoint_name)
         
         self.poller = zmq.Poller()
         self.poller.register(self.control, zmq.POLLIN)
         self.run = True
+        self.startConfiguredProfile()
+        busy = False
         while self.run:
-            events = dict(self.poller.poll(100))
+            events = dict(self.poller.poll(self._pollTimeout(busy)))
+            started = time.perf_counter()
             if self.control in events:
                 if events[self.control] & zmq.POLLIN:
-                    in_packet = self.control.recv_multipart()
-                    peer_id = in_packet[0]
-                    self.handlePacket(peer_id, in_packet[2:])
-            self.processStreams()
+                    self.receivePackets()
+            if self.loading:
+                self.processLoading()
+            busy = self.processStreams()
+            self._countIteration(time.perf_counter() - started)
+            if self.profiler is not None and self.profiler.expired(time.monotonic()):
+                self.stopProfile()
                     
-                
+        self.stopProfile()
+        if self.loaders is not None:
+            self.loaders.shutdown(wait=False, cancel_futures=True)
         self.control.close()
         
+    def _countIteration(self, seconds):
+        self.iterations += 1
+        self.iteration_seconds += seconds
+        if seconds > self.max_iteration_seconds:
+            self.max_iteration_seconds = seconds
+        
+    def _pollTimeout(self, busy):
+        '''
+        Milliseconds to wait for incoming packets: until the earliest deadline of a paced stream, but not more than 100
+        '''
+        if busy:
+            return 0
+        while self.deadlines:
+            (deadline, _, peer_id) = self.deadlines[0]
+            if isinstance(peer_id, Session):
+                stream = peer_id.stream if self.sessions.get(peer_id.name) is peer_id else None
+            else:
+                stream = self.streams.get(peer_id)
+            if stream is not None and stream.deadline == deadline:
+                break
+            heapq.heappop(self.deadlines)
+        max_wait = 100
+        if self.loading:
+            max_wait = _LOADING_POLL_MS
+        if self.blocked:
+            max_wait = _BLOCKED_POLL_MS
+        if not self.deadlines:
+            return max_wait
+        wait = self.deadlines[0][0] - time.monotonic()
+        if wait < 0.001:
+            # Poll timeout has millisecond resolution, so the rest of the wait is slept through
+            if wait > 0:
+                time.sleep(wait)
+            return 0
+        return min(max_wait, int(wait * 1000))
+    
+    def _schedule(self, peer_id, stream, deadline):
+        if stream.deadline != deadline:
+            stream.deadline = deadline
+            self.deadline_seq += 1
+            heapq.heappush(self.deadlines, (deadline, self.deadline_seq, peer_id))
+        
+    def receivePackets(self):
+        '''
+        Handles packets that are already waiting on control socket, at most 'stream-budget' of them
+        '''
+        for _ in range(0, self.stream_budget):
+            try:
+                in_packet = self.control.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            peer_id = in_packet[0]
+            self.handlePacket(peer_id, in_packet[2:])
+        
     def handlePacket(self, peer_id, in_packet):
         if in_packet[0] == b'\x01':
             self.processCommand(peer_id, json.loads(in_packet[1].decode('utf-8')))
         elif in_packet[0] == b'\x03':
-            self.incrementStreamCredit(peer_id)
+            if len(in_packet) > 1:
+                if len(in_packet[1]) != 4:
+                    print("Error: invalid stream credit packet")
+                    self._sendReply(peer_id, {"result" : "error", "reason" : "Invalid stream credit packet"})
+                    return
+                (count,) = struct.unpack("<I", in_packet[1])
+                self.incrementStreamCredit(peer_id, count)
+            else:
+                self.incrementStreamCredit(peer_id)
             
-    def incrementStreamCredit(self, peer_id):
+    def incrementStreamCredit(self, peer_id, count=1):
+        session = self.members.get(peer_id)
+        if session is not None:
+            session.members[peer_id] += count
+            return
         if not peer_id in self.streams:
             print('Error: requested stream credit increment for non-started stream')
             return
         
-        self.streams[peer_id].credit += 1
+        self.streams[peer_id].credit += count
         
     def processStreams(self):
+        '''
+        Sends up to 'stream-budget' items of every stream that has credit, and whose next item is due
+        if the stream is paced. Returns True if some stream still has items to send right away,
+        so that the loop should not wait for incoming packets. Streams of peers that do not keep up
+        with their data are skipped until the peer's queue has room again, keeping their credit
+        '''
+        finished = []
+        busy = False
+        self.blocked = False
+        now = time.monotonic()
         for k, v in self.streams.items():
-            if v.credit > 0:
-                next_item = v.next()
-                if not next_item:
-                    self.stopStream(k)
-                    return
-                (tick_mode, ticker, item, period) = next_item
+            if v.error is not None:
+                self._sendReply(k, {"result" : "error", "reason" : v.error})
+                finished.append(k)
+                continue
+            budget = self.stream_budget
+            while v.credit > 0:
+                if budget == 0:
+                    busy = True
+                    break
+                if v.pending is None:
+                    max_items = min(v.credit, budget, max(v.batch, 1))
+                    item_time = None
+                    due = None
+                    if v.pacer is not None:
+                        item_time = v.peek_time()
+                        due = v.pacer.due(item_time)
+                        if due > now:
+                            self._schedule(k, v, due)
+                            break
+                        max_items = 1
+                    v.pending = self._nextPacket(v, v.next_packets(max_items), item_time, due)
+                    if v.pending is None:
+                        finished.append(k)
+                        break
                 
-                if not item:
-                    self.control.send_multipart([k, b'', b'\x02', (self.exchange_id + ":" + ticker).encode('utf-8'), self._endOfStreamPacket()])
+                (ticker_frame, payload, copy, count, item_time, due) = v.pending
+                try:
+                    if not self._sendData(k, ticker_frame, payload, copy):
+                        self.blocked = True
+                        break
+                except zmq.ZMQError as e:
+                    print("Error: unable to send data to peer:", e)
+                    finished.append(k)
+                    break
+                v.pending = None
+                v.credit -= count
+                v.items_sent += count
+                v.bytes_sent += len(payload)
+                budget -= count
+                if v.pacer is not None:
+                    v.pacer.sent(now, item_time, due)
+                    # The deadline is used up, so that a stream left without credit does not keep waking the loop
+                    v.deadline = None
+        
+        for k in finished:
+            self.stopStream(k)
+        for session in list(self.sessions.values()):
+            busy |= self.processSession(session, now)
+        return busy
+        
+    def processSession(self, session, now):
+        '''
+        Sends up to 'stream-budget' items of the session to its members. Returns True if it has items to send right away
+        '''
+        stream = session.stream
+        if stream is None or (not session.started and len(session.members) < session.expected):
+            return False
+        session.started = True
+        if stream.error is not None:
+            for peer_id in list(session.members):
+                self._sendReply(peer_id, {"result" : "error", "reason" : stream.error})
+            self.closeSession(session)
+            return False
+        budget = self.stream_budget
+        while True:
+            if session.pending is None:
+                credit = session.credit()
+                if credit <= 0:
+                    return False
+                if budget == 0:
+                    return True
+                max_items = min(credit, budget, max(stream.batch, 1))
+                item_time = None
+                due = None
+                if stream.pacer is not None:
+                    item_time = stream.peek_time()
+                    due = stream.pacer.due(item_time)
+                    if due > now:
+                        self._schedule(session, stream, due)
+                        return False
+                    max_items = 1
+                session.pending = self._nextPacket(stream, stream.next_packets(max_items), item_time, due)
+                if session.pending is None:
+                    self.closeSession(session)
+                    return False
+                count = session.pending[3]
+                session.remaining = [peer_id for (peer_id, credit) in session.members.items() if credit >= count]
+                for peer_id in session.members:
+                    if session.members[peer_id] < count:
+                        session.dropped[peer_id] = session.dropped.get(peer_id, 0) + count
+            
+            (ticker_frame, payload, copy, count, item_time, due) = session.pending
+            waiting = []
+            for peer_id in session.remaining:
+                if peer_id not in session.members:
+                    continue
+                try:
+                    sent = self._sendData(peer_id, ticker_frame, payload, copy)
+                except zmq.ZMQError as e:
+                    print("Error: unable to send data to peer:", e)
+                    self.leaveSession(peer_id)
+                    continue
+                if sent:
+                    session.members[peer_id] -= count
+                elif session.policy == "drop":
+                    session.dropped[peer_id] = session.dropped.get(peer_id, 0) + count
                 else:
-                    if tick_mode:
-                        self.control.send_multipart([k, b'', b'\x02', (self.exchange_id + ":" + ticker).encode('utf-8'), self._serializeTick(item)])
-                    else:
-                        self.control.send_multipart([k, b'', b'\x02', (self.exchange_id + ":" + ticker).encode('utf-8'), self._serializeCandle(item, period)])
-                v.credit -= 1
+                    waiting.append(peer_id)
+            session.remaining = waiting
+            if waiting:
+                self.blocked = True
+                return False
+            session.pending = None
+            stream.items_sent += count
+            stream.bytes_sent += len(payload)
+            budget -= count
+            if stream.pacer is not None:
+                stream.pacer.sent(now, item_time, due)
+                stream.deadline = None
         
-    def startStream(self, peer_id, src, from_time, to_time, delay):
-        if to_time and from_time and from_time >= to_time:
-            raise EventloopError("'from' should be earlier than 'to'")
-        self.streams[peer_id] = QuoteStream(src, from_time, to_time, self.config)
+    def _nextPacket(self, stream, next_item, item_time, due):
+        '''
+        Makes (ticker frame, payload, copy, count, item time, due time) to send from result of QuoteStream.next_packets()
+        '''
+        if not next_item:
+            return None
+        (ticker, packets, count) = next_item
+        ticker_frame = stream.ticker_frames.get(ticker)
+        if ticker_frame is None:
+            ticker_frame = (self.exchange_id + ":" + ticker).encode('utf-8')
+            stream.ticker_frames[ticker] = ticker_frame
+        
+        if packets is None:
+            return (ticker_frame, self._endOfStreamPacket(), True, 1, item_time, due)
+        elif stream.batch > 0:
+            return (ticker_frame, wire.batch_header(count) + packets, True, count, item_time, due)
+        return (ticker_frame, packets, False, count, item_time, due)
+        
+    def _sendData(self, peer_id, ticker_frame, payload, copy=True):
+        '''
+        Same as send_multipart(), without its per-frame flag handling. Returns False if the peer's queue is full
+        '''
+        send = self.control.send
+        try:
+            send(peer_id, _SNDMORE | _NOBLOCK)
+        except zmq.Again:
+            return False
+        # The rest of a message is always accepted once its first frame is
+        send(b'', _SNDMORE)
+        send(b'\x02', _SNDMORE)
+        send(ticker_frame, _SNDMORE)
+        send(payload, 0, copy)
+        return True
+    
+    def _sendReply(self, peer_id, reply):
+        try:
+            self.control.send_multipart([peer_id, b'', b'\x01', json.dumps(reply).encode('utf-8')], zmq.NOBLOCK)
+        except zmq.ZMQError as e:
+            print("Error: unable to send reply to peer:", e)
+        
+    def startStream(self, peer_id, src, from_time, to_time, delay, lazy=False, batch=0, speed=0, interval=None, position=None):
+        if peer_id in self.streams:
+            self.stopStream(peer_id)
+        self.leaveSession(peer_id)
+        self.streams[peer_id] = self.createStream(src, from_time, to_time, delay, lazy, batch, speed, interval=interval, position=position)
+        
+    def loadStream(self, peer_id, src, from_time, to_time, delay, lazy=False, batch=0, speed=0, interval=None, position=None):
+        '''
+        Same as startStream(), but files that are not cached yet are loaded by loader processes, in parallel.
+        The stream is started by processLoading() once all of them are loaded
+        '''
+        if peer_id in self.streams:
+            self.stopStream(peer_id)
+        self.cancelLoading(peer_id)
+        self.leaveSession(peer_id)
+        if self.loaders is None:
+            self.loaders = concurrent.futures.ProcessPoolExecutor(self.loader_processes, multiprocessing.get_context('spawn'))
+        loader = csvloader.CsvQuoteLoader(self.config['naive-delta'], sidecars=self.config.get('sidecars', False))
+        from_epoch = utils.datetime_to_epoch(from_time) if from_time else None
+        to_epoch = utils.datetime_to_epoch(to_time) if to_time else None
+        loads = []
+        for file in src:
+            quotes = None
+            try:
+                if self.cache is not None:
+                    if interval is not None:
+                        quotes = self.cache.peek(loader, file, interval)
+                    if quotes is None:
+                        quotes = self.cache.peek(loader, file)
+                if quotes is None and file_window(file, from_epoch, to_epoch, interval, self.config, build=False) is not None:
+                    # Only part of the file in the time window is read, by the stream itself
+                    loads.append(None)
+                    continue
+                rows = self.config.get('index-rows', offsetindex.DEFAULT_ROWS)
+                if (quotes is None and self.config.get('offset-index', False) and (from_epoch is not None or to_epoch is not None)
+                        and not csvloader.is_compressed(file) and offsetindex.read(file, rows) is None):
+                    # The file is loaded in full this time, and its index is built by another loader process for the next streams
+                    self.loaders.submit(offsetindex.get, file, rows)
+            except FileNotFoundError:
+                raise EventloopError("File not found: " + file)
+            if quotes is None:
+                # Raw quotes are cached, so that loaders with and without naive delta share them
+                quotes = self.loaders.submit(csvloader.load_file, file, False, loader.sidecars)
+            loads.append(quotes)
+        self.loading[peer_id] = (loader, src, loads, (from_time, to_time, delay, lazy, batch, speed, interval), position, time.monotonic())
+        
+    def cancelLoading(self, peer_id):
+        if peer_id in self.loading:
+            (_, _, loads, _, _, _) = self.loading.pop(peer_id)
+            for load in loads:
+                if isinstance(load, concurrent.futures.Future):
+                    load.cancel()
+            if not isinstance(peer_id, Session):
+                self._streamReleased(peer_id)
+        
+    def processLoading(self):
+        '''
+        Starts streams whose files are all loaded, and replies to their peers
+        '''
+        for (peer_id, (loader, src, loads, options, position, started)) in list(self.loading.items()):
+            if not all(not isinstance(load, concurrent.futures.Future) or load.done() for load in loads):
+                continue
+            del self.loading[peer_id]
+            try:
+                loaded = []
+                for (file, load) in zip(src, loads):
+                    if isinstance(load, concurrent.futures.Future):
+                        try:
+                            quotes = load.result()
+                            if quotes is not None and self.cache is not None:
+                                quotes = self.cache.derive(loader, file, self.cache.put(loader.raw(), file, quotes))
+                            else:
+                                quotes = loader.derive(quotes)
+                        except FileNotFoundError:
+                            raise EventloopError("File not found: " + file)
+                        except Exception as e:
+                            raise EventloopError("Unable to load file: " + file + ": " + str(e))
+                        if quotes is None:
+                            raise EventloopError("Unable to load file: " + file)
+                        load = quotes
+                    loaded.append(load)
+                (from_time, to_time, delay, lazy, batch, speed, interval) = options
+                stream = self.createStream(src, from_time, to_time, delay, lazy, batch, speed, loaded, interval, position)
+                stream.load_seconds = time.monotonic() - started
+            except EventloopError as e:
+                if isinstance(peer_id, Session):
+                    for member in list(peer_id.members):
+                        self._sendReply(member, {"result" : "error", "reason" : str(e)})
+                    self.closeSession(peer_id)
+                else:
+                    self._sendReply(peer_id, {"result" : "error", "reason" : str(e)})
+                    self._streamReleased(peer_id)
+                continue
+            if isinstance(peer_id, Session):
+                peer_id.stream = stream
+                for member in peer_id.members:
+                    self._sendReply(member, {"result" : "success"})
+            else:
+                self.streams[peer_id] = stream
+                self._sendReply(peer_id, {"result" : "success"})
+        
+    def createStream(self, src, from_time, to_time, delay, lazy=False, batch=0, speed=0, loaded=None, interval=None, position=None):
+        started = time.monotonic()
+        stream = QuoteStream(src, from_time, to_time, self.config, self.cache, lazy, loaded, interval, position)
+        stream.load_seconds = time.monotonic() - started
+        stream.batch = batch
+        if delay > 0 or speed > 0:
+            stream.pacer = Pacer(delay / 1000, speed)
+        return stream
             
     def stopStream(self, peer_id):
-        del self.streams[peer_id]
+        self.streams.pop(peer_id).close()
+        self._streamReleased(peer_id)
+        
+    def joinSession(self, peer_id, command, src, options):
+        '''
+        Adds peer to the session named in start command, starting the session if it does not exist yet. Replies
+        when the stream of the session is loaded
+        '''
+        name = str(command["session"])
+        if "position" in command:
+            raise EventloopError("Sessions can not be resumed from a position")
+        policy = command.get("policy", "slowest")
+        if policy not in Session.POLICIES:
+            raise EventloopError("'policy' should be one of: " + ", ".join(Session.POLICIES))
+        try:
+            expected = int(command.get("members", 1))
+        except (TypeError, ValueError):
+            raise EventloopError("'members' should be a number")
+        if peer_id in self.streams:
+            self.stopStream(peer_id)
+        self.cancelLoading(peer_id)
+        self.leaveSession(peer_id)
+        
+        key = (tuple(src), options, policy)
+        session = self.sessions.get(name)
+        if session is not None and session.key != key:
+            raise EventloopError("Session '" + name + "' was started with other files or options")
+        if session is None:
+            session = Session(name, key, policy, expected)
+            self.loadSession(session, src, options)
+            self.sessions[name] = session
+        session.members[peer_id] = 0
+        self.members[peer_id] = session
+        if session.stream is not None:
+            self._sendReply(peer_id, {"result" : "success"})
+            
+    def loadSession(self, session, src, options):
+        (from_time, to_time, delay, lazy, batch, speed, interval) = options
+        if self.loader_processes > 0 and not lazy:
+            # Members are answered by processLoading()
+            self.loadStream(session, src, from_time, to_time, delay, lazy, batch, speed, interval)
+        else:
+            session.stream = self.createStream(src, from_time, to_time, delay, lazy, batch, speed, interval=interval)
+            
+    def leaveSession(self, peer_id):
+        session = self.members.pop(peer_id, None)
+        if session is None:
+            return
+        del session.members[peer_id]
+        session.dropped.pop(peer_id, None)
+        self._streamReleased(peer_id)
+        if not session.members:
+            self.closeSession(session)
+            
+    def closeSession(self, session):
+        '''
+        Ends the session, releasing all of its members
+        '''
+        if self.sessions.get(session.name) is session:
+            del self.sessions[session.name]
+        for peer_id in session.members:
+            del self.members[peer_id]
+            self._streamReleased(peer_id)
+        session.members.clear()
+        self.cancelLoading(session)
+        if session.stream is not None:
+            session.stream.close()
+            
+    def _streamReleased(self, peer_id):
+        # Worker pool keeps a peer assigned to this worker until every start command of the peer is released
+        if self.worker:
+            self.control.send_multipart([b'', b'released', peer_id])
                 
     def processCommand(self, peer_id, command):
         try:
             if command["command"] == "shutdown":
                 self.handleShutdown(peer_id)
+            elif command["command"] == "stats":
+                self.handleStats(peer_id)
+            elif command["command"] == "position":
+                self.handlePosition(peer_id)
+            elif command["command"] == "profile":
+                self.handleProfile(peer_id, command)
             elif command["command"] == "start":
-                self.handleStart(peer_id, command)
+                try:
+                    self.handleStart(peer_id, command)
+                finally:
+                    if peer_id not in self.streams and peer_id not in self.loading and peer_id not in self.members:
+                        self._streamReleased(peer_id)
         except KeyError:
             pass
         
     def handleShutdown(self, peer_id):
-        self.control.send_multipart([peer_id, b'', b'\x01', json.dumps({"result" : "success"}).encode('utf-8')])
+        self._sendReply(peer_id, {"result" : "success"})
         self.run = False
     
         
+    def handleStats(self, peer_id):
+        self._sendReply(peer_id, self.stats())
+        
+    def handlePosition(self, peer_id):
+        '''
+        Replies with position token of the peer's stream, which a later start command can resume from
+        '''
+        session = self.members.get(peer_id)
+        stream = session.stream if session is not None else self.streams.get(peer_id)
+        if stream is None:
+            self._sendReply(peer_id, {"result" : "error", "reason" : "Stream is not started"})
+            return
+        # Item that was taken from the stream but waits for room in the peer's queue is not sent yet
+        pending = session.pending if session is not None else stream.pending
+        taken = stream.previous if pending is not None else stream.unsent
+        self._sendReply(peer_id, {"result" : "success", "position" : stream.position(taken)})
+        
+    def handleProfile(self, peer_id, command):
+        '''
+        Action "start" (the default) profiles hot paths for "seconds", or until action "stop", with "cprofile" capturing
+        cProfile statistics of the loop thread as well, and writes the results to "output" file when the profile ends.
+        Action "stop" ends running profile and replies with results of the last one
+        '''
+        action = command.get("action", "start")
+        if action == "start":
+            seconds = command.get("seconds")
+            if seconds is not None and (isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds <= 0):
+                self._sendReply(peer_id, {"result" : "error", "reason" : "Invalid profile duration: " + str(seconds)})
+                return
+            if self.profiler is not None:
+                self._sendReply(peer_id, {"result" : "error", "reason" : "Profiling is already running"})
+                return
+            try:
+                self.startProfile(seconds, bool(command.get("cprofile", False)), command.get("output"))
+            except RuntimeError as e:
+                self._sendReply(peer_id, {"result" : "error", "reason" : str(e)})
+                return
+            self._sendReply(peer_id, {"result" : "success"})
+        elif action == "stop":
+            self.stopProfile()
+            if self.profile_results is None:
+                self._sendReply(peer_id, {"result" : "error", "reason" : "Profiling was not started"})
+                return
+            self._sendReply(peer_id, {"result" : "success", "profile" : self.profile_results})
+        else:
+            self._sendReply(peer_id, {"result" : "error", "reason" : "Invalid profile action: " + str(action)})
+        
+    def hotPaths(self):
+        '''
+        Functions timed by profiler as (owner, attribute name, section): file loading, merging streams into packets,
+        serialization of items and sends to peers. Files loaded by loader processes are not timed
+        '''
+        return [(csvloader.CsvQuoteLoader, 'load', 'load'), (QuoteStream, 'next_packets', 'merge'),
+                (wire, 'pack', 'serialize'), (wire, 'batch_header', 'serialize'), (type(self), '_sendData', 'send')]
+        
+    def startProfile(self, seconds=None, cprofile=False, output=None):
+        running = profiler.Profiler(seconds, cprofile, output)
+        running.start(self.hotPaths())
+        self.profiler = running
+        
+    def startConfiguredProfile(self):
+        output = self.config.get('profile')
+        if not output:
+            return
+        if self.worker:
+            # Every worker process writes its own results
+            output += "." + str(os.getpid())
+        try:
+            self.startProfile(self.config.get('profile-seconds'), self.config.get('profile-cprofile', False), output)
+        except RuntimeError as e:
+            print("Error: unable to start profiling:", e)
+        
+    def stopProfile(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profile_results = self.profiler.results()
+            self.profiler = None
+        
+    def stats(self):
+        '''
+        Counters of the event loop and of every stream, keyed by hex peer id
+        '''
+        now = time.monotonic()
+        streams = {}
+        for (peer_id, stream) in self.streams.items():
+            elapsed = now - stream.started
+            streams[peer_id.hex()] = {"items-sent" : stream.items_sent,
+                                      "items-per-sec" : stream.items_sent / elapsed if elapsed > 0 else 0,
+                                      "bytes-sent" : stream.bytes_sent,
+                                      "credit" : stream.credit,
+                                      "load-seconds" : stream.load_seconds,
+                                      "sources" : [{"file" : file, "position" : position, "total" : total}
+                                                   for (file, position, total) in stream.progress()]}
+        sessions = {}
+        for (name, session) in self.sessions.items():
+            sessions[name] = {"members" : {peer_id.hex() : {"credit" : credit, "dropped" : session.dropped.get(peer_id, 0)}
+                                           for (peer_id, credit) in session.members.items()},
+                              "items-sent" : session.stream.items_sent if session.stream is not None else 0,
+                              "policy" : session.policy}
+        result = {"result" : "success",
+                  "streams" : streams,
+                  "sessions" : sessions,
+                  "loading" : len(self.loading),
+                  "loop" : {"iterations" : self.iterations,
+                            "busy-seconds" : self.iteration_seconds,
+                            "mean-iteration-ms" : self.iteration_seconds / self.iterations * 1000 if self.iterations else 0,
+                            "max-iteration-ms" : self.max_iteration_seconds * 1000}}
+        if self.cache is not None:
+            result["cache"] = self.cache.stats()
+        return result
+        
     def handleStart(self, peer_id, command):
+        try:
+            (from_dt, to_dt, delay, lazy, batch, speed, interval) = self._startOptions(command)
+            src = self._startSources(command, from_dt, to_dt, interval)
+            if "session" in command:
+                self.joinSession(peer_id, command, src, (from_dt, to_dt, delay, lazy, batch, speed, interval))
+                return
+            position = command.get("position")
+            if self.loader_processes > 0 and not lazy:
+                # Reply is sent when the files are loaded
+                self.loadStream(peer_id, src, from_dt, to_dt, delay, lazy, batch, speed, interval, position)
+                return
+            self.cancelLoading(peer_id)
+            self.startStream(peer_id, src, from_dt, to_dt, delay, lazy, batch, speed, interval, position)
+            self._sendReply(peer_id, {"result" : "success"})
+        except EventloopError as e:
+            self._sendReply(peer_id, {"result" : "error", "reason" : str(e)})
+            
+    def _startOptions(self, command):
+        '''
+        Returns (from, to, delay, lazy, batch, speed, interval) options of start command
+        '''
         from_dt = None
         if "from" in command:
-            try:
-                from_dt = datetime.datetime.strptime(command["from"], "%Y-%m-%d %H:%M:%S")
-            except ValueError:
-                from_dt = datetime.datetime.strptime(command["from"], "%Y-%m-%d")
+            from_dt = self._parseTime(command["from"])
             
         to_dt = None
         if "to" in command:
-            try:
-                to_dt = datetime.datetime.strptime(command["to"], "%Y-%m-%d %H:%M:%S")
-            except ValueError:
-                to_dt = datetime.datetime.strptime(command["to"], "%Y-%m-%d")
+            to_dt = self._parseTime(command["to"])
+        
+        if to_dt and from_dt and from_dt >= to_dt:
+            raise EventloopError("'from' should be earlier than 'to'")
             
         delay = 0
         try:
@@ -214,26 +1119,57 @@ class EventLoop():
         except KeyError:
             pass # Swallow
         
+        lazy = command.get("lazy", self.config.get('lazy-load', False))
         try:
-            self.startStream(peer_id, command["src"], from_dt, to_dt, delay)
-            self.control.send_multipart([peer_id, b'', b'\x01', json.dumps({"result" : "success"}).encode('utf-8')])
-        except EventloopError as e:
-            self.control.send_multipart([peer_id, b'', b'\x01', json.dumps({"result" : "error", 
-                                    "reason" : str(e)}).encode('utf-8')])
+            batch = int(command.get("batch", 0))
+            speed = float(command.get("speed", 0))
+        except (TypeError, ValueError):
+            raise EventloopError("'batch' and 'speed' should be numbers")
+        interval = None
+        if "interval" in command:
+            interval = self._parseInterval(command["interval"])
+        return (from_dt, to_dt, delay, lazy, batch, speed, interval)
+    
+    def _startSources(self, command, from_dt, to_dt, interval):
+        '''
+        Files of start command: its 'src', or files of its 'tickers' that overlap the requested time window
+        '''
+        if "src" in command:
+            return command["src"]
+        if "tickers" not in command:
+            raise EventloopError("'src' or 'tickers' is required")
+        if self.catalog is None:
+            raise EventloopError("'tickers' require 'data-root' to be configured")
+        tickers = command["tickers"]
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        src = self.catalog.find(tickers, interval, from_dt, to_dt)
+        if not src:
+            raise EventloopError("No files found for tickers: " + ", ".join(str(t) for t in tickers))
+        return src
         
-    def _serializeTick(self, tick):
-        timestamp = int((tick[0] - datetime.datetime(1970, 1, 1)).total_seconds())
-        (price_int, price_frac) = utils.float_to_fixed(tick[1].price)
-        return struct.pack("<IQIIqii", 0x01, timestamp, 0, 0x01, price_int, price_frac, int(tick[1].volume))
+    def _parseInterval(self, value):
+        '''
+        Interval given by its name in quotes.TickerInterval ("min_5") or by its Finam <PER> code ("5")
+        '''
+        try:
+            return li.TickerInterval[value]
+        except (KeyError, TypeError):
+            pass
+        interval = li.interval_by_short_id(value)
+        if interval is None:
+            raise EventloopError("Invalid interval: " + str(value))
+        return interval
     
-    def _serializeCandle(self, candle, period):
-        timestamp = int((candle[0] - datetime.datetime(1970, 1, 1)).total_seconds())
-        (p_open, p_open_frac) = utils.float_to_fixed(candle[1].open_price)
-        (p_high, p_high_frac) = utils.float_to_fixed(candle[1].max_price)
-        (p_low, p_low_frac) = utils.float_to_fixed(candle[1].min_price)
-        (p_close, p_close_frac) = utils.float_to_fixed(candle[1].close_price)
-        return struct.pack("<IQIIqiqiqiqiiI", 0x02, timestamp, 0, 0x01, p_open, p_open_frac, p_high, p_high_frac, p_low, p_low_frac, p_close, p_close_frac,
-                    int(candle[1].volume), int(period))
+    def _parseTime(self, value):
+        try:
+            return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+        try:
+            return datetime.datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise EventloopError("Invalid time: " + value)
         
     def _endOfStreamPacket(self):
         return struct.pack("<II", 0x03, 0x01)
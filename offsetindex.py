@@ -0,0 +1,119 @@
+'''
+
+'''
+
+import os
+import struct
+import numpy as np
+import csvloader
+
+MAGIC = b'QSIDX\x00\x00\x00'
+VERSION = 1
+EXTENSION = ".qsi"
+DEFAULT_ROWS = 16384
+
+# magic, version, rows per entry, source mtime (ns), source size, number of entries; entries follow the header
+HEADER = struct.Struct("<8sIIqqQ")
+HEADER_SIZE = 64
+
+# Timestamp of a row and byte offset of its line in the file, for every 'rows per entry' rows
+ENTRY_DTYPE = np.dtype([('time', '<i8'), ('offset', '<i8')])
+
+def path_for(source):
+    return source + EXTENSION
+
+def read(source, rows):
+    '''
+    Returns index entries of 'source', or None if there is no index with 'rows' rows per entry or it is stale
+    '''
+    stat = os.stat(source)
+    try:
+        with open(path_for(source), 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                return None
+            (magic, version, index_rows, mtime, size, count) = HEADER.unpack_from(header)
+            if magic != MAGIC or version != VERSION or index_rows != rows or mtime != stat.st_mtime_ns or size != stat.st_size:
+                return None
+            entries = np.fromfile(f, dtype=ENTRY_DTYPE, count=count)
+    except OSError:
+        return None
+    if len(entries) != count:
+        return None
+    return entries
+
+def write(source, entries, rows, stat):
+    path = path_for(source)
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    header = HEADER.pack(MAGIC, VERSION, rows, stat.st_mtime_ns, stat.st_size, len(entries))
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b'\x00'))
+            entries.tofile(f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("Unable to write index file", path, ":", e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def build(source, rows):
+    '''
+    Reads 'source' and returns entries for its every 'rows'-th row. Only lines of these rows are parsed
+    '''
+    lines = []
+    offsets = []
+    with open(source, 'rb') as f:
+        header = f.readline()
+        parser = csvloader.CsvParser(header.decode('utf-8'))
+        position = len(header)
+        row = 0
+        for block in csvloader.read_blocks(f, 1 << 24):
+            buf = np.frombuffer(block, dtype=np.uint8)
+            starts = np.concatenate(([0], np.flatnonzero(buf == 10) + 1))
+            starts = starts[starts < len(block)]
+            first = (-row) % rows
+            for start in starts[first::rows].tolist():
+                end = block.find(b'\n', start)
+                lines.append(block[start:end if end >= 0 else len(block)])
+                offsets.append(position + start)
+            row += len(starts)
+            position += len(block)
+    entries = np.empty(len(lines), dtype=ENTRY_DTYPE)
+    if lines:
+        entries['time'] = parser.parse(b'\n'.join(lines))['time']
+        entries['offset'] = offsets
+    return entries
+
+def get(source, rows=DEFAULT_ROWS):
+    '''
+    Returns index entries of 'source', building and saving them if there is no valid index. Returns None for files that can not be indexed
+    '''
+    # Only plain files can be read from an offset, compressed ones have to be decompressed from their start
+    if csvloader.is_compressed(source):
+        return None
+    entries = read(source, rows)
+    if entries is None:
+        stat = os.stat(source)
+        entries = build(source, rows)
+        write(source, entries, rows, stat)
+    return entries
+
+def window(entries, from_time=None, to_time=None):
+    '''
+    Returns (start, stop) byte offsets of the part of the file that holds all of its rows between epoch 'from_time' and 'to_time',
+    stop is None for the end of the file. Rows are sorted by time, so the part starts at the last indexed row before 'from_time'
+    and ends at the first indexed row after 'to_time'
+    '''
+    start = None
+    stop = None
+    if from_time is not None:
+        i = int(np.searchsorted(entries['time'], from_time, 'left')) - 1
+        if i > 0:
+            start = int(entries['offset'][i])
+    if to_time is not None:
+        i = int(np.searchsorted(entries['time'], to_time, 'right'))
+        if i < len(entries):
+            stop = int(entries['offset'][i])
+    return (start, stop)
@@ -0,0 +1,155 @@
+'''
+
+'''
+
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import numpy as np
+
+# Upper bounds of histogram buckets in microseconds, the last bucket holds longer calls
+BUCKETS_US = [1 << i for i in range(0, 24)]
+# Number of durations recorded before they are added to the histogram
+FOLD_SIZE = 4096
+
+_active = None
+_active_lock = threading.Lock()
+
+class Histogram:
+    '''
+    Number of calls in power-of-two buckets of their duration, with their total and longest duration. Durations are
+    recorded by appending them to 'durations', which is atomic and cheap, and added to the buckets in bulk by fold()
+    '''
+    def __init__(self):
+        self.durations = []
+        self.counts = np.zeros(len(BUCKETS_US) + 1, dtype=np.int64)
+        self.total_ns = 0
+        self.max_ns = 0
+        self.lock = threading.Lock()
+
+    def add(self, elapsed_ns):
+        self.durations.append(elapsed_ns)
+        if len(self.durations) >= FOLD_SIZE:
+            self.fold()
+
+    def fold(self):
+        with self.lock:
+            # Other threads only append meanwhile, so the first 'count' durations stay in place until they are deleted
+            count = len(self.durations)
+            if count == 0:
+                return
+            elapsed = np.array(self.durations[:count], dtype=np.int64)
+            del self.durations[:count]
+            # Exponent of frexp() is the bit length of whole microseconds, which is the index of their bucket
+            buckets = np.minimum(np.frexp((elapsed // 1000).astype(np.float64))[1], len(BUCKETS_US))
+            self.counts += np.bincount(buckets, minlength=len(self.counts))
+            self.total_ns += int(elapsed.sum())
+            self.max_ns = max(self.max_ns, int(elapsed.max()))
+
+    def results(self):
+        self.fold()
+        with self.lock:
+            calls = int(self.counts.sum())
+            buckets = {}
+            for (bound, count) in zip(BUCKETS_US + [None], self.counts.tolist()):
+                if count > 0:
+                    buckets["<" + str(bound) if bound is not None else ">=" + str(BUCKETS_US[-1])] = count
+            return {"calls" : calls, "seconds" : self.total_ns / 1e9, "max-us" : self.max_ns / 1000,
+                    "mean-us" : self.total_ns / calls / 1000 if calls else 0, "buckets-us" : buckets}
+
+class Profiler:
+    '''
+    Records histograms of time spent in hot paths of the process for a window of 'seconds' (None for until stop()),
+    and with 'cprofile' also captures cProfile statistics of the thread that starts it. Hot paths are given to start()
+    as (owner, attribute name, section) of functions, which are wrapped with timing while profiling, and cost nothing
+    otherwise. Only one profiler runs in a process at a time
+    '''
+    def __init__(self, seconds=None, cprofile=False, output=None):
+        self.seconds = seconds
+        self.output = output
+        self.profile = cProfile.Profile() if cprofile else None
+        self.sections = {}
+        self.patched = []
+        self.started = None
+        self.stopped = None
+
+    def start(self, hot_paths):
+        global _active
+        with _active_lock:
+            if _active is not None:
+                raise RuntimeError("Profiling is already running")
+            _active = self
+        self.started = time.monotonic()
+        for (owner, name, section) in hot_paths:
+            self.sections.setdefault(section, Histogram())
+            self.patched.append((owner, name, owner.__dict__.get(name)))
+            setattr(owner, name, self._timed(getattr(owner, name), self.sections[section]))
+        if self.profile is not None:
+            self.profile.enable()
+
+    def _timed(self, function, histogram):
+        perf_counter_ns = time.perf_counter_ns
+        durations = histogram.durations
+        fold = histogram.fold
+        def timed(*args, **kwargs):
+            started = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                durations.append(perf_counter_ns() - started)
+                if len(durations) >= FOLD_SIZE:
+                    fold()
+        return timed
+
+    def expired(self, now):
+        return self.seconds is not None and now - self.started >= self.seconds
+
+    def stop(self):
+        '''
+        Restores profiled functions, writing results to 'output' if it was given. Has to be called by the thread that started
+        the profiler when cProfile is captured
+        '''
+        global _active
+        if self.stopped is not None:
+            return
+        if self.profile is not None:
+            self.profile.disable()
+        for (owner, name, original) in reversed(self.patched):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self.stopped = time.monotonic()
+        with _active_lock:
+            if _active is self:
+                _active = None
+        if self.output:
+            self.write(self.output)
+
+    def results(self, top=30):
+        '''
+        Histograms of the sections, and with cProfile the 'top' functions by cumulative time as pstats text
+        '''
+        end = self.stopped if self.stopped is not None else time.monotonic()
+        result = {"seconds" : end - self.started, "running" : self.stopped is None,
+                  "sections" : {name : histogram.results() for (name, histogram) in self.sections.items()}}
+        if self.profile is not None and self.stopped is not None:
+            text = io.StringIO()
+            pstats.Stats(self.profile, stream=text).sort_stats('cumulative').print_stats(top)
+            result["cprofile"] = text.getvalue()
+        return result
+
+    def write(self, path):
+        '''
+        Writes results to 'path' as JSON, and raw cProfile statistics for pstats to 'path'.prof
+        '''
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.results(), f, indent=2)
+            if self.profile is not None:
+                self.profile.dump_stats(path + ".prof")
+        except OSError as e:
+            print("Error: unable to write profile:", path, e)
@@ -0,0 +1,195 @@
+'''
+
+'''
+
+import os
+import threading
+from collections import OrderedDict
+import resample
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_instance = None
+_instance_lock = threading.Lock()
+
+def instance():
+    '''
+    Returns process-wide cache, creating it on first use
+    '''
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = QuoteCache()
+        return _instance
+
+class QuoteCache:
+    '''
+    LRU cache of loaded quotes.Quotes, keyed by file path, its mtime and size and loader settings,
+    and by interval for quotes resampled to it. Quotes of loaders that derive them from quotes of their raw() loader,
+    e.g. with naive delta, are derived from the cached raw quotes instead of parsing the file again.
+    Cached quotes are shared between streams, so their data is made read-only
+    '''
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _key(self, loader, source, interval=None):
+        stat = os.stat(source)
+        key = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size, loader.settings())
+        if interval is not None:
+            key += (interval.name,)
+        return key
+
+    def peek(self, loader, source, interval=None):
+        '''
+        Returns cached quotes for 'source' (resampled to 'interval', if given) if there are any, without loading the file
+        '''
+        key = self._key(loader, source, interval)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if interval is None and loader.raw() is not loader:
+            quotes = self.peek(loader.raw(), source)
+            if quotes is not None:
+                return self.derive(loader, source, quotes)
+        return None
+
+    def get(self, loader, source, interval=None):
+        if interval is not None:
+            quotes = self.peek(loader, source, interval)
+            if quotes is not None:
+                return quotes
+            quotes = self.get(loader, source)
+            return self.resample(loader, source, quotes, interval) if quotes is not None else None
+        if loader.raw() is not loader:
+            quotes = self.peek(loader, source)
+            if quotes is not None:
+                return quotes
+            quotes = self.get(loader.raw(), source)
+            return self.derive(loader, source, quotes) if quotes is not None else None
+
+        key = self._key(loader, source)
+        with self.lock:
+            while True:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]
+                if key not in self.pending:
+                    break
+                # Same file is being loaded by another thread: wait for it instead of parsing it twice
+                loading = self.pending[key]
+                self.lock.release()
+                try:
+                    loading.wait()
+                finally:
+                    self.lock.acquire()
+            self.misses += 1
+            loading = threading.Event()
+            self.pending[key] = loading
+
+        try:
+            quotes = self._prepare(loader.load(source))
+            with self.lock:
+                self._put(key, quotes)
+            return quotes
+        finally:
+            with self.lock:
+                del self.pending[key]
+            loading.set()
+
+    def put(self, loader, source, quotes):
+        '''
+        Adds quotes of 'source' that were loaded elsewhere, e.g. in another process, and returns them ready for streaming
+        '''
+        key = self._key(loader, source)
+        quotes = self._prepare(quotes)
+        with self.lock:
+            self.misses += 1
+            self._put(key, quotes)
+        return quotes
+
+    def resample(self, loader, source, quotes, interval):
+        '''
+        Returns quotes of 'source' resampled to 'interval', resampling them once for all streams
+        '''
+        if quotes.interval == interval:
+            return quotes
+        cached = self.peek(loader, source, interval)
+        if cached is not None:
+            return cached
+        resampled = resample.resample(quotes, interval)
+        if resampled is quotes:
+            return quotes
+        key = self._key(loader, source, interval)
+        resampled = self._prepare(resampled)
+        with self.lock:
+            if key in self.entries:
+                # Resampled meanwhile by another stream
+                return self.entries[key]
+            self.misses += 1
+            self._put(key, resampled)
+        return resampled
+
+    def derive(self, loader, source, quotes):
+        '''
+        Returns quotes of 'source' for 'loader' made from 'quotes' of its raw() loader, deriving them once for all streams
+        '''
+        key = self._key(loader, source)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        derived = loader.derive(quotes)
+        if derived is quotes:
+            return quotes
+        derived = self._prepare(derived)
+        with self.lock:
+            if key in self.entries:
+                # Derived meanwhile by another stream
+                return self.entries[key]
+            self.misses += 1
+            self._put(key, derived)
+        return derived
+
+    def _prepare(self, quotes):
+        if quotes is not None:
+            quotes.data.flags.writeable = False
+            quotes.packets()
+        return quotes
+
+    def _put(self, key, quotes):
+        for old_key in [k for k in self.entries if k[0] == key[0] and k[1:3] != key[1:3]]:
+            self._remove(old_key)
+        size = quotes.nbytes() if quotes is not None else 0
+        if size > self.max_bytes:
+            return
+        self.entries[key] = quotes
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        quotes = self.entries.pop(key)
+        if quotes is not None:
+            self.size -= quotes.nbytes()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries" : len(self.entries), "bytes" : self.size, "max-bytes" : self.max_bytes,
+                    "hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions}
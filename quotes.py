@@ -1,5 +1,8 @@
 from enum import Enum
 import datetime
+import numpy as np
+import utils
+import wire
 
 
 class TickerInterval(Enum):
@@ -61,22 +64,70 @@ class Tick:
         self.price = price
         self.volume = volume
 
+# Prices are kept as fixed-point integers with 9 fractional digits, which is
+# the precision of the (int, frac) pairs used on the wire
+PRICE_SCALE = 1000000000
+
+TICK_DTYPE = np.dtype([('time', '<i8'), ('price', '<i8'), ('volume', '<i8')])
+CANDLE_DTYPE = np.dtype([('time', '<i8'), ('open', '<i8'), ('high', '<i8'), ('low', '<i8'), ('close', '<i8'), ('volume', '<i8')])
+
 class Quotes:
-    def __init__(self, code, interval):
+    '''
+    Time-sorted quotes of one ticker, stored as a structured array with one typed column per field:
+    epoch seconds in 'time', fixed-point prices (see PRICE_SCALE) and integer 'volume'
+    '''
+    def __init__(self, code, interval, tick_mode=False, data=None):
         self.code = code
-        self.candles = []
         self.interval = interval
-        self.tick_mode = False
+        self.tick_mode = tick_mode
+        if data is None:
+            data = np.empty(0, dtype=TICK_DTYPE if tick_mode else CANDLE_DTYPE)
+        self.data = data
+        self._packets = None
+
+    @property
+    def times(self):
+        return self.data['time']
 
     def get_candle(self, index):
-        return self.candles[index]
+        return make_item(self.data[index], self.tick_mode)
 
     def get_by_time(self, time):
-        for candle in self.candles:
-            if candle[0] == time:
-                return candle
+        timestamp = utils.datetime_to_epoch(time)
+        i = int(np.searchsorted(self.times, timestamp))
+        if i < len(self.data) and self.times[i] == timestamp:
+            return self.get_candle(i)
         return None
 
     def total_candles(self):
-        return len(self.candles)
+        return len(self.data)
+
+    def nbytes(self):
+        if self._packets is not None:
+            return self.data.nbytes + self._packets.nbytes
+        return self.data.nbytes
+
+    def period(self):
+        return interval_info(self.interval).delta.total_seconds() if self.interval else 0
+
+    def packets(self):
+        '''
+        Wire packets of all items (see wire module) as one contiguous memoryview, built on first use
+        and kept with the quotes, so that every stream replaying them can send slices of it as they are
+        '''
+        if self._packets is None:
+            self._packets = memoryview(wire.pack(self.data, self.tick_mode, self.period()).view(np.uint8))
+        return self._packets
+
+    def packet_size(self):
+        return wire.TICK_RECORD.itemsize if self.tick_mode else wire.CANDLE_RECORD.itemsize
 
+def make_item(record, tick_mode):
+    '''
+    Builds (datetime, Tick) or (datetime, Candle) out of one record of Quotes.data
+    '''
+    time = utils.epoch_to_datetime(int(record['time']))
+    if tick_mode:
+        return (time, Tick(time, record['price'] / PRICE_SCALE, int(record['volume'])))
+    return (time, Candle(time, record['low'] / PRICE_SCALE, record['high'] / PRICE_SCALE,
+                         record['open'] / PRICE_SCALE, record['close'] / PRICE_SCALE, int(record['volume'])))
@@ -4,23 +4,60 @@
 '''
 
 import argparse
+import os
 import zmq
 from eventloop import EventLoop
+from workers import WorkerPool
+import quotecache
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Quotesource that streams quotes from csv-files')
     parser.add_argument('--exchange-id', help='Specifies exchange ID for all streams', required=True)
     parser.add_argument('--control-ep', help='Specifies control endpoint', required=True)
     parser.add_argument('--naive-delta', action='store_true', help='Enables naive delta calculation (upticks are buy, downticks are sell)')
+    parser.add_argument('--cache-size', type=int, default=quotecache.DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help='Memory budget in MB for loaded files shared between streams, 0 disables the cache')
+    parser.add_argument('--sidecars', action='store_true', help='Keeps parsed files in binary sidecar files next to them for fast reloading')
+    parser.add_argument('--offset-index', action='store_true',
+                        help='Keeps index of byte offsets next to csv-files, so that streams with time window read only that part of the files')
+    parser.add_argument('--lazy-load', action='store_true', help='Parses files in chunks while streaming instead of loading them before the stream starts')
+    parser.add_argument('--stream-budget', type=int, default=256, help='Maximum number of items sent to one stream per event loop iteration')
+    parser.add_argument('--loader-processes', type=int, default=os.cpu_count(),
+                        help='Number of processes that load files of started streams, 0 loads them in the event loop thread')
+    parser.add_argument('--workers', type=int, default=0, help='Serves streams with given number of worker processes')
+    parser.add_argument('--data-root', help='Directory of csv-files that start commands can select by ticker instead of file names')
+    parser.add_argument('--catalog', help='Index file of --data-root, kept in the data root by default')
+    parser.add_argument('--profile', help='Writes time spent in loading, merging, serialization and sends to given JSON file, '
+                        'workers write their own files suffixed with their process id. Use --loader-processes 0 to time loading')
+    parser.add_argument('--profile-seconds', type=float, help='Ends --profile after given number of seconds instead of at shutdown')
+    parser.add_argument('--cprofile', action='store_true', help='Captures cProfile statistics of the event loop with --profile as well')
     
     args = parser.parse_args()
+    if args.stream_budget < 1:
+        parser.error('--stream-budget should be at least 1')
+    if args.profile_seconds is not None and args.profile_seconds <= 0:
+        parser.error('--profile-seconds should be positive')
     
     config = {'naive-delta' : False}
     
     if args.naive_delta:
         config['naive-delta'] = True
+    config['cache-size'] = args.cache_size * 1024 * 1024
+    config['sidecars'] = args.sidecars
+    config['lazy-load'] = args.lazy_load
+    config['offset-index'] = args.offset_index
+    config['stream-budget'] = args.stream_budget
+    config['loader-processes'] = args.loader_processes
+    config['data-root'] = args.data_root
+    config['catalog'] = args.catalog
+    config['profile'] = args.profile
+    config['profile-seconds'] = args.profile_seconds
+    config['profile-cprofile'] = args.cprofile
     
     ctx = zmq.Context.instance()
-    loop = EventLoop(ctx, args.control_ep, args.exchange_id, config)
+    if args.workers > 0:
+        loop = WorkerPool(ctx, args.control_ep, args.exchange_id, config, args.workers)
+    else:
+        loop = EventLoop(ctx, args.control_ep, args.exchange_id, config)
     loop.start()
     loop.wait()
\ No newline at end of file
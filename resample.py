@@ -0,0 +1,94 @@
+'''
+
+'''
+
+import numpy as np
+import quotes as li
+
+_DAY = 86400
+# 1970-01-01 was Thursday, weekly bars start on Monday
+_WEEK_OFFSET = 3 * _DAY
+
+def bar_starts(times, interval):
+    '''
+    Start time of the bar of 'interval' that each of epoch 'times' belongs to. Intraday bars are aligned to midnight
+    '''
+    if interval == li.TickerInterval.week:
+        return (times + _WEEK_OFFSET) // (7 * _DAY) * (7 * _DAY) - _WEEK_OFFSET
+    period = int(li.interval_info(interval).delta.total_seconds())
+    return times - times % period
+
+def check(quotes, interval):
+    '''
+    Raises ValueError if 'quotes' can not be resampled to 'interval': bars can only be merged into bars that consist of a whole number of them
+    '''
+    target = li.interval_info(interval).delta.total_seconds()
+    if quotes.tick_mode:
+        return
+    if target == 0:
+        raise ValueError("bars can not be resampled to ticks")
+    period = quotes.period()
+    if period > 0 and target % period != 0:
+        raise ValueError("bars of " + li.interval_info(quotes.interval).name + " can not be resampled to " +
+                         li.interval_info(interval).name)
+
+def aggregate(data, tick_mode, interval):
+    '''
+    Builds records of quotes.CANDLE_DTYPE out of time-sorted ticks or bars
+    '''
+    if len(data) == 0:
+        return np.empty(0, dtype=li.CANDLE_DTYPE)
+    times = bar_starts(data['time'], interval)
+    starts = np.concatenate(([0], np.flatnonzero(times[1:] != times[:-1]) + 1))
+    lasts = np.append(starts[1:], len(data)) - 1
+    out = np.empty(len(starts), dtype=li.CANDLE_DTYPE)
+    out['time'] = times[starts]
+    if tick_mode:
+        prices = data['price']
+        out['open'] = prices[starts]
+        out['high'] = np.maximum.reduceat(prices, starts)
+        out['low'] = np.minimum.reduceat(prices, starts)
+        out['close'] = prices[lasts]
+        # Naive delta marks sells with negative volume, bars have total volume
+        out['volume'] = np.add.reduceat(np.abs(data['volume']), starts)
+    else:
+        out['open'] = data['open'][starts]
+        out['high'] = np.maximum.reduceat(data['high'], starts)
+        out['low'] = np.minimum.reduceat(data['low'], starts)
+        out['close'] = data['close'][lasts]
+        out['volume'] = np.add.reduceat(data['volume'], starts)
+    return out
+
+def resample(quotes, interval):
+    '''
+    Returns quotes.Quotes with bars of 'interval' built from ticks or finer bars of 'quotes', or 'quotes' themselves if they already are of 'interval'
+    '''
+    if quotes.interval == interval or (quotes.tick_mode and interval == li.TickerInterval.ticks):
+        return quotes
+    check(quotes, interval)
+    return li.Quotes(quotes.code, interval, False, aggregate(quotes.data, quotes.tick_mode, interval))
+
+def resample_chunks(chunks, interval):
+    '''
+    Resamples consecutive chunks of quotes.Quotes of one file. Items of the last bar of each chunk are held back
+    until the next chunk shows that the bar is complete
+    '''
+    try:
+        held = None
+        for quotes in chunks:
+            if quotes.interval == interval or (quotes.tick_mode and interval == li.TickerInterval.ticks):
+                yield quotes
+                continue
+            check(quotes, interval)
+            data = quotes.data if held is None else np.concatenate((held, quotes.data))
+            cut = 0
+            if len(data):
+                times = bar_starts(data['time'], interval)
+                cut = int(np.searchsorted(times, times[-1], 'left'))
+            held = data[cut:]
+            yield li.Quotes(quotes.code, interval, False, aggregate(data[:cut], quotes.tick_mode, interval))
+        if held is not None and len(held):
+            yield li.Quotes(quotes.code, interval, False, aggregate(held, quotes.tick_mode, interval))
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
@@ -0,0 +1,72 @@
+'''
+
+'''
+
+import os
+import struct
+import numpy as np
+import quotes as li
+
+MAGIC = b'QSCBIN\x00\x00'
+VERSION = 1
+EXTENSION = ".qsc"
+
+# magic, version, flags, source mtime (ns), source size, rows, ticker, period short id; records follow the header
+HEADER = struct.Struct("<8sIIqqQ32s8s")
+HEADER_SIZE = 128
+
+FLAG_TICKS = 0x01
+
+def path_for(source):
+    return source + EXTENSION
+
+def read(source):
+    '''
+    Returns quotes.Quotes memory-mapped from sidecar of 'source', or None if there is no sidecar or it is stale
+    '''
+    stat = os.stat(source)
+    try:
+        with open(path_for(source), 'rb') as f:
+            header = f.read(HEADER_SIZE)
+    except OSError:
+        return None
+    if len(header) != HEADER_SIZE:
+        return None
+    (magic, version, flags, mtime, size, rows, code, per_id) = HEADER.unpack_from(header)
+    if magic != MAGIC or version != VERSION or mtime != stat.st_mtime_ns or size != stat.st_size:
+        return None
+
+    tick_mode = bool(flags & FLAG_TICKS)
+    dtype = li.TICK_DTYPE if tick_mode else li.CANDLE_DTYPE
+    if rows > 0:
+        if os.path.getsize(path_for(source)) != HEADER_SIZE + rows * dtype.itemsize:
+            return None
+        data = np.memmap(path_for(source), dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(rows,))
+    else:
+        data = np.empty(0, dtype=dtype)
+    code = code.rstrip(b'\x00').decode('utf-8') or None
+    per_id = per_id.rstrip(b'\x00').decode('utf-8') or None
+    return li.Quotes(code, li.interval_by_short_id(per_id), tick_mode, data)
+
+def write(source, quotes, stat):
+    '''
+    Writes sidecar for quotes loaded from 'source', which had given os.stat() result before loading
+    '''
+    path = path_for(source)
+    if quotes.code and len(quotes.code.encode('utf-8')) > 32:
+        return
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    per_id = li.interval_info(quotes.interval).short_id if quotes.interval else ""
+    header = HEADER.pack(MAGIC, VERSION, FLAG_TICKS if quotes.tick_mode else 0, stat.st_mtime_ns, stat.st_size,
+                         len(quotes.data), (quotes.code or "").encode('utf-8'), per_id.encode('utf-8'))
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b'\x00'))
+            np.ascontiguousarray(quotes.data).tofile(f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("Unable to write sidecar file", path, ":", e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
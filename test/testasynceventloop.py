@@ -0,0 +1,45 @@
+'''
+
+'''
+import unittest
+import zmq
+import struct
+import json
+import time
+from asynceventloop import AsyncEventLoop
+from test import testeventloop
+
+
+class Test(testeventloop.Test):
+    '''
+    Runs scenarios of EventLoop tests against AsyncEventLoop
+    '''
+
+    def createEventLoop(self):
+        return AsyncEventLoop(self.ctx, "inproc://eventloop-control", "MOEX")
+    
+    def testLoadingDoesNotBlockOtherStreams(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"] } )
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        
+        other = self.ctx.socket(zmq.DEALER)
+        other.setsockopt(zmq.RCVTIMEO, 10000)
+        other.connect("inproc://eventloop-control")
+        other.send_multipart([b'', b'\x01', json.dumps({"command" : "start", "src" : ["test/data/GAZP_010101_151231.txt"],
+                                                        "delay" : "1s"}).encode('utf-8')])
+        self.assertEqual(b'\x01', other.recv_multipart()[1])
+        other.send_multipart([b'', b'\x03', struct.pack("<I", 2)])
+        other.recv_multipart()
+        
+        # Second item of the other stream is a second away, this stream is served meanwhile
+        start = time.monotonic()
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 100)])
+        for _ in range(0, 100):
+            self.recvStreamPacket()
+        self.assertLess(time.monotonic() - start, 0.5)
+        other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+'''
+
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import benchmark
+import csvloader
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testGeneratesFinamFiles(self):
+        for tick_mode in (True, False):
+            filenames = benchmark.generate(self.directory, 10001, 3, tick_mode)
+            
+            self.assertEqual(3, len(filenames))
+            loaded = [csvloader.CsvQuoteLoader().load(filename) for filename in filenames]
+            self.assertEqual(10001, sum(quotes.total_candles() for quotes in loaded))
+            for (i, quotes) in enumerate(loaded):
+                self.assertEqual("T%03d" % i, quotes.code)
+                self.assertEqual(tick_mode, quotes.tick_mode)
+                self.assertTrue((np.diff(quotes.times) >= 0).all())
+                
+    def testReportsAllMeasurements(self):
+        results = benchmark.run(self.directory, 5000, 2, True, 1000, 10)
+        
+        for name in ("load", "naive-delta", "serialize", "merge", "merge-batch-256", "stream", "stream-batch-256"):
+            self.assertGreater(results[name]["seconds"], 0)
+        self.assertEqual(5002, results["merge"]["items"])
+        self.assertIn("p99-ms", results["stream"]["credit-round-trip"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+
+'''
+import unittest
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import catalog
+import quotes as li
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "daily"))
+        self.ticks = os.path.join(self.dir, "GAZP_ticks.txt")
+        self.bars = os.path.join(self.dir, "daily", "GAZP_010101_151231.txt")
+        shutil.copy("test/data/GAZP_ticks.txt", self.ticks)
+        shutil.copy("test/data/GAZP_010101_151231.txt", self.bars)
+        with open(os.path.join(self.dir, "notes.md"), "w") as f:
+            f.write("not quotes\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testScansFiles(self):
+        c = catalog.Catalog(self.dir)
+        c.refresh()
+
+        self.assertEqual(["GAZP_ticks.txt", os.path.join("daily", "GAZP_010101_151231.txt")], list(c.entries.keys()))
+        entry = c.entries["GAZP_ticks.txt"]
+        self.assertEqual(("GAZP", "0", True, 8186), (entry["ticker"], entry["per"], entry["ticks"], entry["rows"]))
+        self.assertEqual(1427882399, entry["first"])
+        bars = c.entries[os.path.join("daily", "GAZP_010101_151231.txt")]
+        self.assertEqual(("D", 2295, 1137974400), (bars["per"], bars["rows"], bars["first"]))
+
+    def testFindsFilesOverlappingWindow(self):
+        c = catalog.Catalog(self.dir)
+
+        self.assertEqual([self.ticks], c.find(["GAZP"]))
+        self.assertEqual([self.bars], c.find(["GAZP"], li.TickerInterval.day))
+        self.assertEqual([self.bars], c.find(["GAZP"], li.TickerInterval.week))
+        # Hourly bars are built from ticks
+        self.assertEqual([self.ticks], c.find(["GAZP"], li.TickerInterval.hour_1))
+        self.assertEqual([self.bars], c.find(["GAZP"], None, datetime.datetime(2010, 1, 1), datetime.datetime(2011, 1, 1)))
+        self.assertEqual([], c.find(["SBER"]))
+
+    def testRefreshesChangedFilesOnly(self):
+        c = catalog.Catalog(self.dir, max_age=0)
+        c.refresh()
+        scanned = []
+        original = catalog.scan
+        catalog.scan = lambda path: scanned.append(path) or original(path)
+        try:
+            with open(self.ticks, "a") as f:
+                f.write("\nGAZP,0,20150402,100000,140.000000000,1")
+            compressed = os.path.join(self.dir, "SBER_ticks.txt.gz")
+            with open("test/data/GAZP_ticks.txt", "rb") as src, gzip.open(compressed, "wb") as f:
+                f.write(src.read().replace(b"GAZP", b"SBER"))
+            os.remove(self.bars)
+            c.refresh()
+        finally:
+            catalog.scan = original
+
+        self.assertEqual(sorted([self.ticks, compressed]), sorted(scanned))
+        self.assertEqual(8187, c.entries["GAZP_ticks.txt"]["rows"])
+        self.assertEqual([compressed], c.find(["SBER"]))
+        # Daily bars are built from ticks once the daily file is gone
+        self.assertEqual([self.ticks], c.find(["GAZP"], li.TickerInterval.day))
+
+    def testKeepsIndexBetweenRuns(self):
+        catalog.Catalog(self.dir).refresh()
+        c = catalog.Catalog(self.dir)
+
+        self.assertTrue(os.path.exists(os.path.join(self.dir, catalog.FILENAME)))
+        self.assertEqual(2, len(c.entries))
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
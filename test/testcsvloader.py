@@ -4,6 +4,13 @@
 import unittest
 import csvloader
 import datetime
+import tempfile
+import os
+import shutil
+import gzip
+import bz2
+import lzma
+import zipfile
 
 
 class Test(unittest.TestCase):
@@ -42,6 +49,134 @@ class Test(unittest.TestCase):
         
         self.assertEqual(datetime.datetime(2015, 4, 1, 9, 59, 59), first_tick_time)
 
+    def testStoresColumns(self):
+        quotes = self.loader.load("test/data/GAZP_ticks.txt")
+        
+        self.assertEqual(8186, len(quotes.times))
+        self.assertEqual(1427882399, quotes.times[0])
+        self.assertEqual(138450000000, quotes.data['price'][0])
+        self.assertEqual(10, quotes.data['volume'][0])
+        self.assertTrue((quotes.times[1:] >= quotes.times[:-1]).all())
+
+    def testParsesPricesExactly(self):
+        parser = csvloader.CsvParser("<TICKER>,<PER>,<DATE>,<TIME>,<LAST>,<VOL>")
+        prices = ["138.45", "12345678.123456789", "-0.000000001", "+7", "1.0000000005", "-2.0000000015", "0.1"]
+        data = parser.parse("".join("GAZP,0,20150401,100000,%s,%d\n" % (price, i + 1) for (i, price) in enumerate(prices)).encode('utf-8'))
+        
+        self.assertEqual([138450000000, 12345678123456789, -1, 7000000000, 1000000001, -2000000002, 100000000], data['price'].tolist())
+        self.assertEqual(list(range(1, len(prices) + 1)), data['volume'].tolist())
+        
+    def testRejectsPricesOutOfRange(self):
+        parser = csvloader.CsvParser("<TICKER>,<PER>,<DATE>,<TIME>,<LAST>,<VOL>")
+        
+        self.assertEqual([999999999000000000], parser.parse(b"GAZP,0,20150401,100000,999999999,1")['price'].tolist())
+        self.assertRaises(Exception, parser.parse, b"GAZP,0,20150401,100000,1000000000.5,1")
+        self.assertRaises(Exception, parser.parse, b"GAZP,0,20150401,100000,1.2.3,1")
+
+    def testRejectsMixedTickers(self):
+        (fd, path) = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "w") as f:
+            f.write("<TICKER>,<PER>,<DATE>,<TIME>,<LAST>,<VOL>\n")
+            f.write("GAZP,0,20150401,095959,138.45,10\n")
+            f.write("SBER,0,20150401,095959,70.1,20\n")
+        try:
+            self.assertRaises(Exception, self.loader.load, path)
+        finally:
+            os.remove(path)
+
+    def testLoadsCompressedFiles(self):
+        plain = self.loader.load("test/data/GAZP_ticks.txt")
+        with open("test/data/GAZP_ticks.txt", "rb") as f:
+            text = f.read()
+        directory = tempfile.mkdtemp()
+        try:
+            for (ext, module) in [(".gz", gzip), (".bz2", bz2), (".xz", lzma)]:
+                path = os.path.join(directory, "GAZP_ticks.txt" + ext)
+                with module.open(path, "wb") as f:
+                    f.write(text)
+                self.assertTrue(self.loader.probe(path))
+                
+                self.assertEqual(plain.data.tolist(), self.loader.load(path).data.tolist())
+                chunks = list(csvloader.CsvQuoteLoader().load_chunks(path, 4096))
+                self.assertGreater(len(chunks), 1)
+                self.assertEqual(plain.total_candles(), sum(quotes.total_candles() for quotes in chunks))
+        finally:
+            shutil.rmtree(directory)
+            
+    def testLoadsZipMembersInOrder(self):
+        plain = self.loader.load("test/data/GAZP_ticks.txt")
+        with open("test/data/GAZP_ticks.txt") as f:
+            lines = f.readlines()
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "GAZP_ticks.zip")
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("part1.txt", "".join(lines[:4000]))
+                archive.writestr("part2.txt", "".join(lines[:1] + lines[4000:]))
+            self.assertTrue(self.loader.probe(path))
+            
+            self.assertEqual(plain.data.tolist(), self.loader.load(path).data.tolist())
+            
+            with zipfile.ZipFile(path, "w") as archive:
+                archive.writestr("part1.txt", "".join(lines[:4000]))
+                archive.writestr("part2.txt", "<TICKER>,<DATE>,<TIME>,<LAST>,<VOL>\n")
+            self.assertRaises(Exception, self.loader.load, path)
+        finally:
+            shutil.rmtree(directory)
+            
+    def expectedDelta(self, quotes):
+        '''
+        Signs volumes tick by tick: upticks are buys, downticks are sells, zero ticks repeat the previous side
+        '''
+        (volumes, prev_price, buy) = ([], None, True)
+        for (_, price, volume) in quotes.data.tolist():
+            if prev_price is not None and price != prev_price:
+                buy = price > prev_price
+            volumes.append(volume if buy else -volume)
+            prev_price = price
+        return volumes
+
+    def testAppliesNaiveDelta(self):
+        raw = self.loader.load("test/data/GAZP_ticks.txt")
+        delta = csvloader.CsvQuoteLoader(naive_delta=True).load("test/data/GAZP_ticks.txt")
+        
+        self.assertEqual(self.expectedDelta(raw), delta.data['volume'].tolist())
+        self.assertTrue((delta.data['volume'] < 0).any())
+        self.assertEqual(raw.data['price'].tolist(), delta.data['price'].tolist())
+
+    def testNaiveDeltaStartsOverForEachFile(self):
+        loader = csvloader.CsvQuoteLoader(naive_delta=True)
+        first = loader.load("test/data/GAZP_ticks.txt")
+        second = loader.load("test/data/GAZP_ticks.txt")
+        
+        self.assertEqual(first.data.tolist(), second.data.tolist())
+        
+    def testNaiveDeltaCarriesOverChunks(self):
+        loader = csvloader.CsvQuoteLoader(naive_delta=True)
+        chunks = list(loader.load_chunks("test/data/GAZP_ticks.txt", 4096))
+        
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(loader.load("test/data/GAZP_ticks.txt").data['volume'].tolist(),
+                         [volume for chunk in chunks for volume in chunk.data['volume'].tolist()])
+
+    def testDerivesNaiveDeltaFromReadOnlyQuotes(self):
+        loader = csvloader.CsvQuoteLoader(naive_delta=True)
+        raw = loader.raw().load("test/data/GAZP_ticks.txt")
+        raw.data.flags.writeable = False
+        delta = loader.derive(raw)
+        
+        self.assertFalse(loader.raw().naive_delta)
+        self.assertEqual(self.expectedDelta(raw), delta.data['volume'].tolist())
+        self.assertTrue((raw.data['volume'] > 0).all())
+        bars = loader.load("test/data/GAZP_010101_151231.txt")
+        self.assertIs(bars, loader.derive(bars))
+
+    def testProbesExtensions(self):
+        self.assertTrue(self.loader.probe("GAZP.csv.bz2"))
+        self.assertTrue(self.loader.probe("GAZP.TXT"))
+        self.assertFalse(self.loader.probe("GAZP.json.gz"))
+        self.assertFalse(self.loader.probe("GAZP.qsc"))
+
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
@@ -5,9 +5,17 @@ import unittest
 import zmq
 import struct
 import csv
-from eventloop import EventLoop
+from eventloop import EventLoop, EventloopError, QuoteStream
 import datetime
 import json
+import time
+import os
+import shutil
+import tempfile
+import numpy as np
+import quotes as li
+import wire
+import csvloader
 
 
 class Test(unittest.TestCase):
@@ -16,14 +24,17 @@ class Test(unittest.TestCase):
     def setUp(self):
         self.ctx = zmq.Context.instance()
         self.control = self.ctx.socket(zmq.DEALER)
-        self.eventloop = EventLoop(self.ctx,
-                                   "inproc://eventloop-control",
-                                   "MOEX")
+        # Lost packets fail the test instead of blocking it forever
+        self.control.setsockopt(zmq.RCVTIMEO, 10000)
+        self.eventloop = self.createEventLoop()
         
         self.control.connect("inproc://eventloop-control")
         
         self.eventloop.start()
 
+    def createEventLoop(self):
+        return EventLoop(self.ctx, "inproc://eventloop-control", "MOEX")
+
     def tearDown(self):
         self.eventloop.stop()
         self.ctx.destroy()
@@ -195,8 +206,609 @@ class Test(unittest.TestCase):
         self.assertEqual("success", response["result"])
         
         self.doTicksCheck("test/data/GAZP_ticks.txt", datetime.datetime(2015, 4, 1, 10, 10), datetime.datetime(2015, 4, 1, 11, 0))
+
+    def testTickFeed_batchedCredit(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"] } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 1000)])
+        with open("test/data/GAZP_ticks.txt") as csvfile:
+            r = csv.DictReader(csvfile)
+            for _ in range(0, 1000):
+                row = next(r)
+                packet = self.recvStreamPacket()
+                (packet_type, timestamp, _, _, price_int, price_frac, volume) = struct.unpack("<IQIIqii", packet[1])
+                self.assertEqual(0x01, packet_type)
+                self.assertAlmostEqual(float(row["<LAST>"]), price_int + price_frac / 1000000000)
+                self.assertEqual(int(row["<VOL>"]), volume)
+        
+        self.assertEqual(0, self.control.poll(200))
+        
+    def testTickFeed_creditAboveHighWaterMark(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"] } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 9000)])
+        time.sleep(0.3)
+        for _ in range(0, 8186):
+            self.recvStreamPacket()
+        
+        packet = self.recvStreamPacket()
+        self.assertEqual(struct.pack("<II", 0x03, 0x01), packet[1])
+        
+    def testInvalidCreditPacket(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"] } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', b''])
+        response = self.recvControlResponse()
+        self.assertEqual("error", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 1)])
+        packet = self.recvStreamPacket()
+        self.assertEqual(0x01, struct.unpack_from("<I", packet[1])[0])
+        
+    def testStats(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"] } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 10)])
+        for _ in range(0, 10):
+            self.recvStreamPacket()
+        
+        self.sendControlCommand( {"command" : "stats"} )
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        self.assertEqual(1, len(response["streams"]))
+        stream = list(response["streams"].values())[0]
+        self.assertEqual(10, stream["items-sent"])
+        self.assertEqual(10 * 36, stream["bytes-sent"])
+        self.assertEqual(0, stream["credit"])
+        self.assertEqual([{"file" : "test/data/GAZP_ticks.txt", "position" : 10, "total" : 8186}], stream["sources"])
+        
+    def testTickFeed_batched(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "batch" : 100 } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 10000)])
+        with open("test/data/GAZP_ticks.txt") as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        
+        received = 0
+        while received < len(rows):
+            packet = self.recvStreamPacket()
+            self.assertEqual("MOEX:GAZP", packet[0].decode('utf-8'))
+            (packet_type, count) = struct.unpack_from("<II", packet[1])
+            self.assertEqual(0x04, packet_type)
+            self.assertLessEqual(count, 100)
+            self.assertEqual(8 + count * 36, len(packet[1]))
+            for i in range(0, count):
+                (packet_type, timestamp, useconds, datatype, price_int, price_frac, volume) = struct.unpack_from("<IQIIqii", packet[1], 8 + i * 36)
+                row = rows[received + i]
+                this_time = datetime.datetime.strptime(row["<DATE>"] + "-" + row["<TIME>"], "%Y%m%d-%H%M%S")
+                self.assertEqual(0x01, packet_type)
+                self.assertEqual(int((this_time - datetime.datetime(1970, 1, 1)).total_seconds()), timestamp)
+                self.assertAlmostEqual(float(row["<LAST>"]), price_int + price_frac / 1000000000)
+                self.assertEqual(int(row["<VOL>"]), volume)
+            received += count
+        
+        packet = self.recvStreamPacket()
+        self.assertEqual(struct.pack("<II", 0x03, 0x01), packet[1])
+        
+    def testTickFeed_invalidBatch(self):
+        for options in [{"batch" : "abc"}, {"speed" : "fast"}]:
+            command = {"command" : "start", "src" : ["test/data/GAZP_ticks.txt"]}
+            command.update(options)
+            self.sendControlCommand(command)
+            
+            response = self.recvControlResponse()
+            self.assertEqual("error", response["result"])
+        
+        self.sendControlCommand({"command" : "shutdown"})
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        
+    def testTickFeed_delay(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "delay" : "50ms" } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 5)])
+        start = time.monotonic()
+        for _ in range(0, 5):
+            self.recvStreamPacket()
+        
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        
+    def testTickFeed_delayIdlesWithoutCredit(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "delay" : "20ms" } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 2)])
+        for _ in range(0, 2):
+            self.recvStreamPacket()
+        
+        cpu = time.process_time()
+        time.sleep(0.5)
+        self.assertLess(time.process_time() - cpu, 0.1)
+        
+    def testBarFeed_speed(self):
+        # Daily bars replayed 864000 times faster than real time: 0.1 s per day
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_010101_151231.txt"],
+                                 "speed" : 864000 } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 3)])
+        times = []
+        for _ in range(0, 3):
+            packet = self.recvStreamPacket()
+            times.append((time.monotonic(), struct.unpack_from("<IQ", packet[1])[1]))
+        
+        for i in range(1, 3):
+            expected = (times[i][1] - times[0][1]) / 864000
+            self.assertAlmostEqual(expected, times[i][0] - times[0][0], delta=0.05)
+        
+    def testTickFeed_lazy(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "lazy" : True } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        self.doTicksCheck("test/data/GAZP_ticks.txt", None, None)
             
 
+    def testTickFeed_resampled(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "interval" : "min_5" } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        
+        with open("test/data/GAZP_ticks.txt") as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 10000)])
+        volume = 0
+        while True:
+            packet = self.recvStreamPacket()
+            if packet[1] == struct.pack("<II", 0x03, 0x01):
+                break
+            fields = struct.unpack("<IQIIqiqiqiqiiI", packet[1])
+            self.assertEqual(0x02, fields[0])
+            self.assertEqual(0, fields[1] % 300)
+            self.assertEqual(300, fields[13])
+            volume += fields[12]
+        self.assertEqual(sum(int(row["<VOL>"]) for row in rows), volume)
+        
+    def testBarFeed_invalidInterval(self):
+        for interval in ["min_7", "min_1"]:
+            self.sendControlCommand( {"command" : "start",
+                                     "src" : ["test/data/GAZP_010101_151231.txt"],
+                                     "interval" : interval } )
+            
+            response = self.recvControlResponse()
+            self.assertEqual("error", response["result"])
+            
+
+    def testStartByTickers_withoutDataRoot(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "tickers" : ["GAZP"] } )
+        
+        response = self.recvControlResponse()
+        self.assertEqual("error", response["result"])
+        
+        self.sendControlCommand( {"command" : "start"} )
+        response = self.recvControlResponse()
+        self.assertEqual("error", response["result"])
+
+        
+    def testResumeFromPosition(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"] } )
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 100)])
+        received = [self.recvStreamPacket()[1] for _ in range(0, 100)]
+        
+        self.sendControlCommand( {"command" : "position"} )
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "position" : response["position"] } )
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 9000)])
+        while True:
+            packet = self.recvStreamPacket()[1]
+            if packet == struct.pack("<II", 0x03, 0x01):
+                break
+            received.append(packet)
+        
+        times = csvloader.CsvQuoteLoader().load("test/data/GAZP_ticks.txt").times
+        self.assertEqual(times.tolist(), [struct.unpack_from("<IQ", packet)[1] for packet in received])
+        
+    def testResumeFromPosition_invalidPosition(self):
+        self.sendControlCommand( {"command" : "position"} )
+        self.assertEqual("error", self.recvControlResponse()["result"])
+        
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "position" : {"time" : 1} } )
+        self.assertEqual("error", self.recvControlResponse()["result"])
+
+    def testProfile(self):
+        self.sendControlCommand( {"command" : "profile", "action" : "stop"} )
+        self.assertEqual("error", self.recvControlResponse()["result"])
+        self.sendControlCommand( {"command" : "profile", "cprofile" : True} )
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        self.sendControlCommand( {"command" : "profile"} )
+        self.assertEqual("error", self.recvControlResponse()["result"])
+
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"],
+                                 "batch" : 100 } )
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 1000)])
+        (items, packets) = (0, 0)
+        while items < 1000:
+            items += struct.unpack_from("<II", self.recvStreamPacket()[1])[1]
+            packets += 1
+
+        self.sendControlCommand( {"command" : "profile", "action" : "stop"} )
+        response = self.recvControlResponse()
+        self.assertEqual("success", response["result"])
+        sections = response["profile"]["sections"]
+        self.assertEqual(packets, sections["send"]["calls"])
+        self.assertEqual(packets, sum(sections["send"]["buckets-us"].values()))
+        self.assertLessEqual(packets, sections["merge"]["calls"])
+        self.assertLessEqual(packets, sections["serialize"]["calls"])
+        self.assertIn("function calls", response["profile"]["cprofile"])
+        self.assertEqual("_sendData", type(self.eventloop)._sendData.__name__)
+
+    def testProfile_timedWindow(self):
+        output = os.path.join(tempfile.mkdtemp(), "profile.json")
+        try:
+            self.sendControlCommand( {"command" : "profile", "seconds" : 0} )
+            self.assertEqual("error", self.recvControlResponse()["result"])
+            self.sendControlCommand( {"command" : "profile", "seconds" : 0.2, "output" : output} )
+            self.assertEqual("success", self.recvControlResponse()["result"])
+            self.sendControlCommand( {"command" : "start",
+                                     "src" : ["test/data/GAZP_ticks.txt"] } )
+            self.assertEqual("success", self.recvControlResponse()["result"])
+
+            deadline = time.monotonic() + 5
+            while not os.path.exists(output) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            with open(output) as f:
+                profile = json.load(f)
+            self.assertFalse(profile["running"])
+            self.assertEqual(["load", "merge", "send", "serialize"], sorted(profile["sections"]))
+        finally:
+            shutil.rmtree(os.path.dirname(output))
+
+    def connectPeer(self):
+        peer = self.ctx.socket(zmq.DEALER)
+        peer.setsockopt(zmq.RCVTIMEO, 10000)
+        peer.connect("inproc://eventloop-control")
+        return peer
+        
+    def joinSession(self, peer, command):
+        peer.send_multipart([b'', b'\x01', json.dumps(dict({"command" : "start", "src" : ["test/data/GAZP_ticks.txt"],
+                                                             "session" : "replay"}, **command)).encode('utf-8')])
+        
+    def recvPeerResponse(self, peer):
+        response = peer.recv_multipart()
+        self.assertEqual(b'\x01', response[1])
+        return json.loads(response[2].decode('utf-8'))
+        
+    def testSession_sharedReplay(self):
+        other = self.connectPeer()
+        self.joinSession(self.control, {"members" : 2})
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 10)])
+        # Session waits for its second member
+        self.assertEqual(0, self.control.poll(200))
+        self.joinSession(other, {"members" : 2})
+        self.assertEqual("success", self.recvPeerResponse(other)["result"])
+        # and advances at the credit of its slowest member
+        self.assertEqual(0, self.control.poll(200))
+        
+        other.send_multipart([b'', b'\x03', struct.pack("<I", 10)])
+        received = [self.recvStreamPacket() for _ in range(0, 10)]
+        self.assertEqual(received, [other.recv_multipart()[2:] for _ in range(0, 10)])
+        expected = csvloader.CsvQuoteLoader().load("test/data/GAZP_ticks.txt").times[:10]
+        self.assertEqual(expected.tolist(), [struct.unpack_from("<IQ", packet[1])[1] for packet in received])
+        self.assertEqual(0, self.control.poll(200))
+        other.close()
+        
+    def testSession_mismatchedStart(self):
+        other = self.connectPeer()
+        self.joinSession(self.control, {})
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        
+        self.joinSession(other, {"src" : ["test/data/GAZP_010101_151231.txt"]})
+        self.assertEqual("error", self.recvPeerResponse(other)["result"])
+        self.joinSession(other, {"policy" : "drop"})
+        self.assertEqual("error", self.recvPeerResponse(other)["result"])
+        self.joinSession(other, {"policy" : "fastest"})
+        self.assertEqual("error", self.recvPeerResponse(other)["result"])
+        other.close()
+        
+    def testSession_dropPolicy(self):
+        other = self.connectPeer()
+        self.joinSession(self.control, {"policy" : "drop"})
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        self.joinSession(other, {"policy" : "drop"})
+        self.assertEqual("success", self.recvPeerResponse(other)["result"])
+        
+        # Session does not wait for the member without credit, which misses the items
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 10)])
+        for _ in range(0, 10):
+            self.recvStreamPacket()
+        other.send_multipart([b'', b'\x03', struct.pack("<I", 1)])
+        packet = other.recv_multipart()
+        expected = csvloader.CsvQuoteLoader().load("test/data/GAZP_ticks.txt").times[10]
+        self.assertEqual(expected, struct.unpack_from("<IQ", packet[3])[1])
+        self.assertEqual(0, other.poll(200))
+        self.assertEqual(0, self.control.poll(0))
+        
+        self.sendControlCommand( {"command" : "stats"} )
+        response = self.recvControlResponse()
+        session = response["sessions"]["replay"]
+        self.assertEqual("drop", session["policy"])
+        self.assertEqual(11, session["items-sent"])
+        self.assertEqual([1, 10], sorted(member["dropped"] for member in session["members"].values()))
+        other.close()
+            
+
+class LoaderProcessesTest(Test):
+    '''
+    Runs EventLoop scenarios with files loaded by loader processes
+    '''
+    
+    def createEventLoop(self):
+        return EventLoop(self.ctx, "inproc://eventloop-control", "MOEX", {'naive-delta' : False, 'loader-processes' : 2, 'cache-size' : 0})
+    
+    def testServesOtherStreamsWhileLoading(self):
+        self.sendControlCommand( {"command" : "start",
+                                 "src" : ["test/data/GAZP_ticks.txt"] } )
+        self.assertEqual("success", self.recvControlResponse()["result"])
+        
+        other = self.ctx.socket(zmq.DEALER)
+        other.setsockopt(zmq.RCVTIMEO, 10000)
+        other.connect("inproc://eventloop-control")
+        other.send_multipart([b'', b'\x01', json.dumps({"command" : "start", "src" : ["test/data/GAZP_010101_151231.txt", "test/data/GAZP_ticks.txt"]}).encode('utf-8')])
+        # Credit is handled while the files of the other peer are loaded
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 10)])
+        for _ in range(0, 10):
+            self.recvStreamPacket()
+        
+        response = other.recv_multipart()
+        self.assertEqual("success", json.loads(response[2].decode('utf-8'))["result"])
+        other.close()
+
+
+class DataRootTest(unittest.TestCase):
+    '''
+    Starts streams by tickers found in the catalog of test data
+    '''
+    
+    def setUp(self):
+        self.ctx = zmq.Context.instance()
+        self.dir = tempfile.mkdtemp()
+        self.control = self.ctx.socket(zmq.DEALER)
+        self.control.setsockopt(zmq.RCVTIMEO, 10000)
+        self.control.connect("inproc://eventloop-control")
+        self.eventloop = EventLoop(self.ctx, "inproc://eventloop-control", "MOEX",
+                                   {'naive-delta' : False, 'data-root' : "test/data", 'catalog' : os.path.join(self.dir, "catalog.json")})
+        self.eventloop.start()
+        
+    def tearDown(self):
+        self.eventloop.stop()
+        self.ctx.destroy()
+        shutil.rmtree(self.dir)
+        
+    def startByTickers(self, command):
+        self.control.send_multipart([b'', b'\x01', json.dumps(dict(command, command="start", tickers=["GAZP"])).encode('utf-8')])
+        response = json.loads(self.control.recv_multipart()[2].decode('utf-8'))
+        self.assertEqual("success", response["result"])
+        self.control.send_multipart([b'', b'\x03', struct.pack("<I", 1)])
+        return self.control.recv_multipart()[3]
+        
+    def testStartsFinestData(self):
+        packet = self.startByTickers({})
+        self.assertEqual((0x01, 1427882399), struct.unpack_from("<IQ", packet))
+        
+    def testStartsDataOfInterval(self):
+        packet = self.startByTickers({"interval" : "D", "from" : "2010-01-01"})
+        fields = struct.unpack("<IQIIqiqiqiqiiI", packet)
+        self.assertEqual(0x02, fields[0])
+        self.assertEqual(86400, fields[13])
+        self.assertLessEqual(1262304000, fields[1])
+
+
+class QuoteStreamTest(unittest.TestCase):
+    
+    def readAll(self, stream, max_items=1, limit=None):
+        '''
+        Reads stream packets as list of (ticker, packet fields), with None fields for end-of-stream markers,
+        stopping after at least 'limit' items if it is given
+        '''
+        items = []
+        while limit is None or len(items) < limit:
+            item = stream.next_packets(max_items)
+            if item is None:
+                return items
+            (ticker, packets, count) = item
+            if packets is None:
+                items.append((ticker, None))
+                continue
+            self.assertLessEqual(count, max_items)
+            record = wire.TICK_RECORD if len(packets) == count * wire.TICK_RECORD.itemsize else wire.CANDLE_RECORD
+            items.extend((ticker, fields) for fields in np.frombuffer(packets, dtype=record).tolist())
+        return items
+    
+    def testMergesSourcesByTime(self):
+        stream = QuoteStream(["test/data/GAZP_010101_151231.txt", "test/data/GAZP_ticks.txt"], None, None, {'naive-delta' : False})
+        items = self.readAll(stream)
+        
+        self.assertEqual(2295 + 8186 + 2, len(items))
+        times = [fields[1] for (_, fields) in items if fields is not None]
+        self.assertEqual(sorted(times), times)
+        # Tick source ends first, each marker follows the last packet of its source
+        end_markers = [wire.PACKET_TICK if len(items[i - 1][1] or ()) == 7 else wire.PACKET_CANDLE for i in range(0, len(items)) if items[i][1] is None]
+        self.assertEqual([wire.PACKET_TICK, wire.PACKET_CANDLE], end_markers)
+        
+    def testLowerSourceIndexWinsOnEqualTimestamps(self):
+        stream = QuoteStream(["test/data/GAZP_ticks.txt", "test/data/GAZP_ticks.txt"], None, None, {'naive-delta' : False})
+        for _ in range(0, 4):
+            stream.next_packets(1)
+        
+        self.assertEqual([4, 0], stream.indices)
+
+    def testBatchesFollowMergeOrder(self):
+        files = ["test/data/GAZP_010101_151231.txt", "test/data/GAZP_ticks.txt", "test/data/GAZP_ticks.txt"]
+        expected = self.readAll(QuoteStream(files, None, None, {'naive-delta' : False}))
+        batched = self.readAll(QuoteStream(files, None, None, {'naive-delta' : False}), 50)
+        
+        self.assertEqual(expected, batched)
+
+    def testSeeksToTimeWindow(self):
+        stream = QuoteStream(["test/data/GAZP_010101_151231.txt"], datetime.datetime(2010, 1, 1), datetime.datetime(2010, 12, 30), {'naive-delta' : False})
+        times = stream.quotes[0].times
+        first = int((times < 1262304000).sum())
+        last = int((times <= 1293667200).sum())
+        
+        self.assertEqual([first], stream.indices)
+        self.assertEqual([last], stream.stops)
+        items = self.readAll(stream)
+        self.assertEqual(last - first + 1, len(items))
+        self.assertEqual(1293667200, items[-2][1][1])
+
+    def testLazySourcesMatchLoadedSources(self):
+        files = ["test/data/GAZP_010101_151231.txt", "test/data/GAZP_ticks.txt"]
+        config = {'naive-delta' : False, 'chunk-size' : 4096, 'cache-size' : 0}
+        for (from_time, to_time) in [(None, None), (datetime.datetime(2015, 4, 1, 10, 10), datetime.datetime(2015, 4, 1, 11, 0))]:
+            loaded = self.readAll(QuoteStream(files, from_time, to_time, config))
+            lazy_stream = QuoteStream(files, from_time, to_time, config, lazy=True)
+            lazy = self.readAll(lazy_stream)
+            lazy_stream.close()
+            
+            self.assertEqual(loaded, lazy)
+
+    def testLazySourcesResampleAcrossChunks(self):
+        config = {'naive-delta' : False, 'chunk-size' : 4096, 'cache-size' : 0}
+        loaded = self.readAll(QuoteStream(["test/data/GAZP_ticks.txt"], None, None, config, interval=li.TickerInterval.min_1))
+        lazy_stream = QuoteStream(["test/data/GAZP_ticks.txt"], None, None, config, lazy=True, interval=li.TickerInterval.min_1)
+        lazy = self.readAll(lazy_stream)
+        lazy_stream.close()
+        
+        self.assertEqual(loaded, lazy)
+        self.assertEqual(60, loaded[0][1][13])
+
+    def testReadsTimeWindowThroughOffsetIndex(self):
+        directory = tempfile.mkdtemp()
+        try:
+            files = [os.path.join(directory, "ticks.txt"), os.path.join(directory, "bars.txt")]
+            shutil.copy("test/data/GAZP_ticks.txt", files[0])
+            shutil.copy("test/data/GAZP_010101_151231.txt", files[1])
+            window = (datetime.datetime(2015, 4, 1, 10, 10), datetime.datetime(2015, 4, 1, 10, 40))
+            config = {'naive-delta' : False, 'chunk-size' : 4096}
+            indexed = dict(config, **{'offset-index' : True, 'index-rows' : 100})
+            for (lazy, interval) in [(False, None), (True, None), (False, li.TickerInterval.min_5), (True, li.TickerInterval.min_5)]:
+                src = files if interval is None else files[:1]
+                expected = self.readAll(QuoteStream(src, *window, config, lazy=lazy, interval=interval))
+                stream = QuoteStream(src, *window, indexed, lazy=lazy, interval=interval)
+                items = self.readAll(stream)
+                stream.close()
+                
+                self.assertEqual(expected, items)
+                if not lazy:
+                    whole = QuoteStream(src, None, None, config, interval=interval).quotes[0].total_candles()
+                    self.assertLess(stream.quotes[0].total_candles(), whole)
+        finally:
+            shutil.rmtree(directory)
+
+    def testLazySourceReportsParseError(self):
+        with open("test/data/GAZP_ticks.txt") as f:
+            lines = f.readlines()
+        filename = "test/data/broken_ticks.txt"
+        with open(filename, "w") as f:
+            f.writelines(lines[:-1] + ["GAZP,0,20150401,not a time,150.0,10\n"])
+        try:
+            stream = QuoteStream([filename], None, None, {'naive-delta' : False, 'chunk-size' : 4096, 'cache-size' : 0}, lazy=True)
+            items = self.readAll(stream)
+            stream.close()
+        finally:
+            os.remove(filename)
+        
+        self.assertIsNotNone(stream.error)
+        self.assertTrue(all(fields is not None for (_, fields) in items))
+        self.assertLess(len(items), len(lines) - 2)
+
+    def testResumesFromPosition(self):
+        # Same file twice gives runs of equal timestamps in both sources
+        files = ["test/data/GAZP_010101_151231.txt", "test/data/GAZP_ticks.txt", "test/data/GAZP_ticks.txt"]
+        config = {'naive-delta' : False, 'chunk-size' : 4096, 'cache-size' : 0}
+        expected = self.readAll(QuoteStream(files, None, None, config))
+        for (lazy, max_items) in ((False, 1), (False, 300), (True, 7)):
+            for limit in (0, 1, 2296, 5000, len(expected) - 2):
+                stream = QuoteStream(files, None, None, config, lazy=lazy)
+                items = self.readAll(stream, max_items, limit)
+                position = json.loads(json.dumps(stream.position()))
+                stream.close()
+                resumed = QuoteStream(files, None, None, config, lazy=lazy, position=position)
+                items += self.readAll(resumed, max_items)
+                resumed.close()
+                    
+                self.assertEqual(expected, items, (lazy, max_items, limit))
+                
+    def testResumesBeforeLastRun(self):
+        files = ["test/data/GAZP_ticks.txt"]
+        stream = QuoteStream(files, None, None, {'naive-delta' : False})
+        items = self.readAll(stream, 10, 10)
+        self.readAll(stream, 10, 10)
+        position = stream.position(stream.previous)
+        
+        items += self.readAll(QuoteStream(files, None, None, {'naive-delta' : False}, position=position))
+        self.assertEqual(self.readAll(QuoteStream(files, None, None, {'naive-delta' : False})), items)
+        
+    def testRejectsPositionOfOtherFiles(self):
+        position = QuoteStream(["test/data/GAZP_ticks.txt"], None, None, {'naive-delta' : False}).position()
+        
+        with self.assertRaises(EventloopError):
+            QuoteStream(["test/data/GAZP_010101_151231.txt"], None, None, {'naive-delta' : False}, position=position)
+        position.update({"files" : ["test/data/GAZP_010101_151231.txt"], "time" : 1})
+        with self.assertRaises(EventloopError):
+            QuoteStream(["test/data/GAZP_010101_151231.txt"], None, None, {'naive-delta' : False}, position=position)
+
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,70 @@
+'''
+
+'''
+import unittest
+import gzip
+import os
+import shutil
+import tempfile
+import csvloader
+import offsetindex
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.loader = csvloader.CsvQuoteLoader()
+        self.dir = tempfile.mkdtemp()
+        self.ticks = os.path.join(self.dir, "ticks.txt")
+        shutil.copy("test/data/GAZP_ticks.txt", self.ticks)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testIndexesEveryNthRow(self):
+        entries = offsetindex.get(self.ticks, 100)
+        quotes = self.loader.load(self.ticks)
+
+        self.assertTrue(os.path.exists(offsetindex.path_for(self.ticks)))
+        self.assertEqual(82, len(entries))
+        self.assertEqual(quotes.times[::100].tolist(), entries['time'].tolist())
+        with open(self.ticks, 'rb') as f:
+            for (i, offset) in enumerate(entries['offset'].tolist()):
+                f.seek(offset)
+                self.assertEqual(quotes.times[i * 100], self.loader.load_range(self.ticks, offset, offset + len(f.readline())).times[0])
+
+    def testWindowHoldsAllRowsOfTimeRange(self):
+        entries = offsetindex.get(self.ticks, 100)
+        times = self.loader.load(self.ticks).times
+        (from_time, to_time) = (int(times[1000]), int(times[1500]))
+        (start, stop) = offsetindex.window(entries, from_time, to_time)
+        part = self.loader.load_range(self.ticks, start, stop)
+
+        self.assertLess(part.total_candles(), 800)
+        expected = times[(times >= from_time) & (times <= to_time)]
+        self.assertEqual(expected.tolist(), part.times[(part.times >= from_time) & (part.times <= to_time)].tolist())
+        self.assertEqual((None, None), offsetindex.window(entries, None, None))
+
+    def testRebuildsStaleIndex(self):
+        offsetindex.get(self.ticks, 100)
+        with open(self.ticks, "a") as f:
+            f.write("\nGAZP,0,20150402,100000,140.000000000,1")
+
+        self.assertIsNone(offsetindex.read(self.ticks, 100))
+        self.assertIsNone(offsetindex.read(self.ticks, 50))
+        entries = offsetindex.get(self.ticks, 100)
+        self.assertEqual(82, len(entries))
+        self.assertIsNotNone(offsetindex.read(self.ticks, 100))
+
+    def testSkipsCompressedFiles(self):
+        compressed = self.ticks + ".gz"
+        with open(self.ticks, "rb") as src, gzip.open(compressed, "wb") as f:
+            f.write(src.read())
+
+        self.assertIsNone(offsetindex.get(compressed, 100))
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+
+'''
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import csvloader
+import profiler
+import wire
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testTimesHotPathsWhileRunning(self):
+        original = wire.pack
+        original_load = csvloader.CsvQuoteLoader.load
+        p = profiler.Profiler()
+        p.start([(csvloader.CsvQuoteLoader, 'load', 'load'), (wire, 'pack', 'serialize')])
+        try:
+            self.assertIsNot(original, wire.pack)
+            quotes = csvloader.CsvQuoteLoader().load("test/data/GAZP_ticks.txt")
+            quotes.packets()
+        finally:
+            p.stop()
+
+        self.assertIs(original, wire.pack)
+        self.assertIs(original_load, csvloader.CsvQuoteLoader.load)
+        sections = p.results()["sections"]
+        self.assertEqual(1, sections["load"]["calls"])
+        self.assertEqual(1, sections["serialize"]["calls"])
+        self.assertLessEqual(sections["serialize"]["max-us"], sections["serialize"]["seconds"] * 1e6)
+        csvloader.CsvQuoteLoader().load("test/data/GAZP_ticks.txt")
+        self.assertEqual(1, p.results()["sections"]["load"]["calls"])
+
+    def testRestoresInheritedMethods(self):
+        class Base:
+            def f(self):
+                return 1
+        class Derived(Base):
+            pass
+        p = profiler.Profiler()
+        p.start([(Derived, 'f', 'call')])
+        self.assertEqual(1, Derived().f())
+        p.stop()
+
+        self.assertNotIn('f', Derived.__dict__)
+        self.assertEqual(1, p.results()["sections"]["call"]["calls"])
+
+    def testRunsOneProfilerAtATime(self):
+        p = profiler.Profiler()
+        p.start([])
+        try:
+            with self.assertRaises(RuntimeError):
+                profiler.Profiler().start([])
+        finally:
+            p.stop()
+        other = profiler.Profiler()
+        other.start([])
+        other.stop()
+
+    def testHistogramBuckets(self):
+        h = profiler.Histogram()
+        for elapsed_ns in [500, 1500, 3000, 3999, 10 ** 13]:
+            h.add(elapsed_ns)
+
+        result = h.results()
+        self.assertEqual(5, result["calls"])
+        self.assertEqual({"<1" : 1, "<2" : 1, "<4" : 2, ">=" + str(profiler.BUCKETS_US[-1]) : 1}, result["buckets-us"])
+        self.assertEqual(1e10, result["max-us"])
+
+    def testWritesResults(self):
+        output = os.path.join(self.dir, "profile.json")
+        p = profiler.Profiler(cprofile=True, output=output)
+        p.start([(csvloader.CsvQuoteLoader, 'load', 'load')])
+        csvloader.CsvQuoteLoader().load("test/data/GAZP_ticks.txt")
+        p.stop()
+
+        with open(output) as f:
+            result = json.load(f)
+        self.assertEqual(1, result["sections"]["load"]["calls"])
+        self.assertIn("load", result["cprofile"])
+        self.assertTrue(os.path.exists(output + ".prof"))
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
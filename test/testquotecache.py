@@ -0,0 +1,102 @@
+'''
+
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import csvloader
+import quotecache
+import quotes as li
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.loader = csvloader.CsvQuoteLoader()
+        self.dir = tempfile.mkdtemp()
+        self.ticks = os.path.join(self.dir, "ticks.txt")
+        self.bars = os.path.join(self.dir, "bars.txt")
+        shutil.copy("test/data/GAZP_ticks.txt", self.ticks)
+        shutil.copy("test/data/GAZP_010101_151231.txt", self.bars)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testReusesLoadedQuotes(self):
+        cache = quotecache.QuoteCache()
+        first = cache.get(self.loader, self.ticks)
+        second = cache.get(self.loader, self.ticks)
+        
+        self.assertIs(first, second)
+        self.assertFalse(first.data.flags.writeable)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        
+    def testKeyIncludesLoaderSettings(self):
+        cache = quotecache.QuoteCache()
+        raw = cache.get(self.loader, self.ticks)
+        delta = cache.get(csvloader.CsvQuoteLoader(naive_delta=True), self.ticks)
+        
+        self.assertIsNot(raw, delta)
+        self.assertEqual(2, cache.misses)
+        
+    def testDerivesNaiveDeltaFromCachedQuotes(self):
+        cache = quotecache.QuoteCache()
+        raw = cache.get(self.loader, self.ticks)
+        loader = csvloader.CsvQuoteLoader(naive_delta=True)
+        parsed = []
+        original = csvloader.CsvQuoteLoader.parse
+        csvloader.CsvQuoteLoader.parse = lambda self, *args: parsed.append(args) or original(self, *args)
+        try:
+            delta = cache.get(loader, self.ticks)
+            self.assertIs(delta, cache.peek(loader, self.ticks))
+        finally:
+            csvloader.CsvQuoteLoader.parse = original
+        
+        self.assertEqual([], parsed)
+        self.assertEqual(loader.load(self.ticks).data.tolist(), delta.data.tolist())
+        self.assertTrue((raw.data['volume'] > 0).all())
+        self.assertEqual(2, cache.stats()["entries"])
+        
+    def testReloadsModifiedFile(self):
+        cache = quotecache.QuoteCache()
+        first = cache.get(self.loader, self.ticks)
+        with open(self.ticks, "a") as f:
+            f.write("\nGAZP,0,20150401,120000,140.000000000,1")
+        second = cache.get(self.loader, self.ticks)
+        
+        self.assertEqual(first.total_candles() + 1, second.total_candles())
+        self.assertEqual(1, cache.stats()["entries"])
+        
+    def testEvictsLeastRecentlyUsed(self):
+        ticks = self.loader.load(self.ticks)
+        bars = self.loader.load(self.bars)
+        ticks.packets()
+        bars.packets()
+        (ticks_size, bars_size) = (ticks.nbytes(), bars.nbytes())
+        cache = quotecache.QuoteCache(max(ticks_size, bars_size))
+        cache.get(self.loader, self.ticks)
+        cache.get(self.loader, self.bars)
+        cache.get(self.loader, self.ticks)
+        
+        self.assertEqual(3, cache.misses)
+        self.assertEqual(2, cache.evictions)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def testCachesResampledQuotesPerInterval(self):
+        cache = quotecache.QuoteCache()
+        five = cache.get(self.loader, self.ticks, li.TickerInterval.min_5)
+        hour = cache.get(self.loader, self.ticks, li.TickerInterval.hour_1)
+        
+        self.assertIs(five, cache.get(self.loader, self.ticks, li.TickerInterval.min_5))
+        self.assertIsNot(five, hour)
+        self.assertFalse(five.data.flags.writeable)
+        # Raw ticks are loaded once for both intervals
+        self.assertEqual(3, cache.misses)
+        self.assertEqual(3, cache.stats()["entries"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+'''
+
+'''
+import unittest
+import numpy as np
+import csvloader
+import quotes as li
+import resample
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.loader = csvloader.CsvQuoteLoader()
+        self.ticks = self.loader.load("test/data/GAZP_ticks.txt")
+        self.bars = self.loader.load("test/data/GAZP_010101_151231.txt")
+
+    def expectedBars(self, data, tick_mode, period):
+        '''
+        Aggregates records one by one into (time, open, high, low, close, volume) tuples
+        '''
+        bars = []
+        for record in data.tolist():
+            if tick_mode:
+                (time, price, volume) = record
+                (o, h, l, c) = (price, price, price, price)
+            else:
+                (time, o, h, l, c, volume) = record
+            start = time - time % period
+            if bars and bars[-1][0] == start:
+                bar = bars[-1]
+                bars[-1] = (start, bar[1], max(bar[2], h), min(bar[3], l), c, bar[5] + abs(volume))
+            else:
+                bars.append((start, o, h, l, c, abs(volume)))
+        return bars
+
+    def testBuildsBarsFromTicks(self):
+        bars = resample.resample(self.ticks, li.TickerInterval.min_5)
+
+        self.assertFalse(bars.tick_mode)
+        self.assertEqual(300, bars.period())
+        self.assertEqual(self.expectedBars(self.ticks.data, True, 300), bars.data.tolist())
+
+    def testMergesFinerBars(self):
+        hourly = resample.resample(self.ticks, li.TickerInterval.hour_1)
+        from_bars = resample.resample(resample.resample(self.ticks, li.TickerInterval.min_5), li.TickerInterval.hour_1)
+
+        self.assertEqual(hourly.data.tolist(), from_bars.data.tolist())
+
+    def testWeeksStartOnMonday(self):
+        weeks = resample.resample(self.bars, li.TickerInterval.week)
+
+        days = weeks.times // 86400
+        # 1970-01-05 was Monday
+        self.assertTrue(((days - 4) % 7 == 0).all())
+        self.assertEqual(int(self.bars.data['volume'].sum()), int(weeks.data['volume'].sum()))
+        self.assertEqual(int(self.bars.data['high'].max()), int(weeks.data['high'].max()))
+
+    def testKeepsQuotesOfSameInterval(self):
+        self.assertIs(self.bars, resample.resample(self.bars, li.TickerInterval.day))
+        self.assertIs(self.ticks, resample.resample(self.ticks, li.TickerInterval.ticks))
+
+    def testRejectsFinerInterval(self):
+        with self.assertRaises(ValueError):
+            resample.resample(self.bars, li.TickerInterval.hour_1)
+        with self.assertRaises(ValueError):
+            resample.resample(self.bars, li.TickerInterval.ticks)
+
+    def testChunksMatchWholeFile(self):
+        chunks = self.loader.load_chunks("test/data/GAZP_ticks.txt", 4096)
+        resampled = list(resample.resample_chunks(chunks, li.TickerInterval.min_1))
+
+        self.assertGreater(len(resampled), 1)
+        self.assertEqual(resample.resample(self.ticks, li.TickerInterval.min_1).data.tolist(),
+                         np.concatenate([quotes.data for quotes in resampled]).tolist())
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import csvloader
+import sidecar
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.loader = csvloader.CsvQuoteLoader(sidecars=True)
+        self.dir = tempfile.mkdtemp()
+        self.ticks = os.path.join(self.dir, "ticks.txt")
+        self.bars = os.path.join(self.dir, "bars.txt")
+        shutil.copy("test/data/GAZP_ticks.txt", self.ticks)
+        shutil.copy("test/data/GAZP_010101_151231.txt", self.bars)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testMapsWrittenSidecar(self):
+        for path in (self.ticks, self.bars):
+            parsed = self.loader.load(path)
+            self.assertTrue(os.path.exists(sidecar.path_for(path)))
+            
+            mapped = self.loader.load(path)
+            self.assertIsInstance(mapped.data, np.memmap)
+            self.assertEqual(parsed.code, mapped.code)
+            self.assertEqual(parsed.interval, mapped.interval)
+            self.assertEqual(parsed.tick_mode, mapped.tick_mode)
+            self.assertTrue((parsed.data == mapped.data).all())
+        
+    def testIgnoresStaleSidecar(self):
+        self.loader.load(self.ticks)
+        with open(self.ticks, "a") as f:
+            f.write("\nGAZP,0,20150401,120000,140.000000000,1")
+        
+        self.assertIsNone(sidecar.read(self.ticks))
+        self.assertEqual(8187, self.loader.load(self.ticks).total_candles())
+        self.assertEqual(8187, sidecar.read(self.ticks).total_candles())
+        
+    def testAppliesNaiveDeltaToMappedTicks(self):
+        self.loader.load(self.ticks)
+        delta = csvloader.CsvQuoteLoader(naive_delta=True, sidecars=True).load(self.ticks)
+        expected = csvloader.CsvQuoteLoader(naive_delta=True).load(self.ticks)
+        
+        self.assertTrue((expected.data == delta.data).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
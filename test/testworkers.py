@@ -0,0 +1,105 @@
+'''
+
+'''
+import unittest
+import zmq
+import struct
+import json
+import time
+from workers import WorkerPool
+
+
+class Test(unittest.TestCase):
+
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ctx = zmq.Context.instance()
+        cls.pool = WorkerPool(cls.ctx, "inproc://workerpool-control", "MOEX", {'naive-delta' : False}, 2)
+        cls.pool.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.stop()
+        
+    def connectPeer(self):
+        peer = self.ctx.socket(zmq.DEALER)
+        # Lost packets fail the test instead of blocking it forever
+        peer.setsockopt(zmq.RCVTIMEO, 10000)
+        peer.connect("inproc://workerpool-control")
+        return peer
+        
+    def startStream(self, peer, src):
+        peer.send_multipart([b'', b'\x01', json.dumps({"command" : "start", "src" : src}).encode('utf-8')])
+        response = peer.recv_multipart()
+        self.assertEqual(b'\x01', response[1])
+        return json.loads(response[2].decode('utf-8'))
+    
+    def waitReleased(self):
+        for _ in range(0, 100):
+            if not self.pool.assignments:
+                return
+            time.sleep(0.05)
+        
+    def testServesPeersWithDifferentWorkers(self):
+        peers = [self.connectPeer(), self.connectPeer()]
+        for peer in peers:
+            self.assertEqual("success", self.startStream(peer, ["test/data/GAZP_010101_151231.txt"])["result"])
+        self.assertEqual(2, len(set(self.pool.assignments.values())))
+        
+        # Credit above high-water mark: both streams are sent in full while the peers are read one after another
+        for peer in peers:
+            peer.send_multipart([b'', b'\x03', struct.pack("<I", 3000)])
+        time.sleep(0.3)
+        for peer in peers:
+            bars = 0
+            while True:
+                packet = peer.recv_multipart()
+                self.assertEqual(b'\x02', packet[1])
+                self.assertEqual(b'MOEX:GAZP', packet[2])
+                if packet[3] == struct.pack("<II", 0x03, 0x01):
+                    break
+                bars += 1
+            self.assertEqual(2295, bars)
+            peer.close()
+        
+        self.waitReleased()
+        self.assertEqual({}, self.pool.assignments)
+        self.assertEqual([0, 0], list(self.pool.load.values()))
+        
+    def testRoutesSessionMembersToSameWorker(self):
+        peers = [self.connectPeer(), self.connectPeer()]
+        for peer in peers:
+            peer.send_multipart([b'', b'\x01', json.dumps({"command" : "start", "src" : ["test/data/GAZP_010101_151231.txt"],
+                                                            "session" : "shared", "members" : 2}).encode('utf-8')])
+        for peer in peers:
+            self.assertEqual("success", json.loads(peer.recv_multipart()[2].decode('utf-8'))["result"])
+        self.assertEqual(1, len(set(self.pool.assignments.values())))
+        
+        for peer in peers:
+            peer.send_multipart([b'', b'\x03', struct.pack("<I", 10)])
+        packets = [[peer.recv_multipart()[2:] for _ in range(0, 10)] for peer in peers]
+        self.assertEqual(packets[0], packets[1])
+        
+        # Members are released at the end of the session
+        for peer in peers:
+            peer.send_multipart([b'', b'\x03', struct.pack("<I", 3000)])
+        for peer in peers:
+            while peer.recv_multipart()[3] != struct.pack("<II", 0x03, 0x01):
+                pass
+            peer.close()
+        self.waitReleased()
+        self.assertEqual({}, self.pool.assignments)
+        
+    def testReportsErrorsFromWorker(self):
+        peer = self.connectPeer()
+        
+        self.assertEqual("error", self.startStream(peer, ["does-not-exist.txt"])["result"])
+        peer.close()
+        
+        self.waitReleased()
+        self.assertEqual({}, self.pool.assignments)
+
+
+if __name__ == "__main__":
+    unittest.main()
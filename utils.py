@@ -2,6 +2,24 @@
 
 '''
 
+import datetime
+import numpy as np
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
 def float_to_fixed(value):
     i = int(value)
-    return (i, int((value - i) * 1000000000) )
\ No newline at end of file
+    return (i, int((value - i) * 1000000000) )
+
+def datetime_to_epoch(dt):
+    return int((dt - EPOCH).total_seconds())
+
+def epoch_to_datetime(timestamp):
+    return EPOCH + datetime.timedelta(seconds=timestamp)
+
+def split_fixed(values):
+    '''
+    Splits NumPy array of fixed-point integers into (int, frac) arrays, both truncated towards zero like float_to_fixed does
+    '''
+    ints = np.abs(values) // 1000000000 * np.sign(values)
+    return (ints, values - ints * 1000000000)
@@ -0,0 +1,57 @@
+'''
+
+'''
+
+import struct
+import numpy as np
+import utils
+
+PACKET_TICK = 0x01
+PACKET_CANDLE = 0x02
+PACKET_END_OF_STREAM = 0x03
+PACKET_BATCH = 0x04
+
+# Same layouts as "<IQIIqii" tick and "<IQIIqiqiqiqiiI" candle packets
+TICK_RECORD = np.dtype([('type', '<u4'), ('time', '<u8'), ('useconds', '<u4'), ('datatype', '<u4'),
+                        ('price', '<i8'), ('price_frac', '<i4'), ('volume', '<i4')])
+CANDLE_RECORD = np.dtype([('type', '<u4'), ('time', '<u8'), ('useconds', '<u4'), ('datatype', '<u4'),
+                          ('open', '<i8'), ('open_frac', '<i4'), ('high', '<i8'), ('high_frac', '<i4'),
+                          ('low', '<i8'), ('low_frac', '<i4'), ('close', '<i8'), ('close_frac', '<i4'),
+                          ('volume', '<i4'), ('period', '<u4')])
+
+# Batch packet: type and number of records, followed by the records
+BATCH_HEADER = struct.Struct("<II")
+
+def pack_ticks(ticks):
+    '''
+    Packs records of quotes.TICK_DTYPE into an array of tick packets
+    '''
+    out = np.zeros(len(ticks), dtype=TICK_RECORD)
+    out['type'] = PACKET_TICK
+    out['time'] = ticks['time']
+    out['datatype'] = 0x01
+    (out['price'], out['price_frac']) = utils.split_fixed(ticks['price'])
+    out['volume'] = ticks['volume']
+    return out
+
+def pack_candles(candles, period):
+    '''
+    Packs records of quotes.CANDLE_DTYPE into an array of candle packets
+    '''
+    out = np.zeros(len(candles), dtype=CANDLE_RECORD)
+    out['type'] = PACKET_CANDLE
+    out['time'] = candles['time']
+    out['datatype'] = 0x01
+    for field in ('open', 'high', 'low', 'close'):
+        (out[field], out[field + '_frac']) = utils.split_fixed(candles[field])
+    out['volume'] = candles['volume']
+    out['period'] = period
+    return out
+
+def pack(records, tick_mode, period):
+    if tick_mode:
+        return pack_ticks(records)
+    return pack_candles(records, period)
+
+def batch_header(count):
+    return BATCH_HEADER.pack(PACKET_BATCH, count)
@@ -0,0 +1,229 @@
+'''
+
+'''
+
+import collections
+import json
+import multiprocessing
+import multiprocessing.connection
+import threading
+import zlib
+import zmq
+from eventloop import EventLoop, EventloopError
+
+def run_worker(endpoint, exchange_id, config):
+    ctx = zmq.Context()
+    loop = EventLoop(ctx, endpoint, exchange_id, config, worker=True)
+    loop.start()
+    # Workers are not left running when the pool process dies without shutting them down
+    watcher = threading.Thread(target=watch_parent, args=(loop,), daemon=True)
+    watcher.start()
+    loop.wait()
+    ctx.destroy(linger=0)
+
+def watch_parent(loop):
+    multiprocessing.connection.wait([multiprocessing.parent_process().sentinel])
+    print("Error: worker pool exited, stopping worker")
+    loop.run = False
+
+class WorkerPool():
+    '''
+    Front end that serves streams with several worker processes, each running its own EventLoop.
+    Peers talk to a single control endpoint; all packets of a peer go to the worker it was assigned to
+    by its start command, and worker packets are routed back to the peer by its id. A peer stays assigned
+    until the worker reports that all of its streams are released. Start commands of a shared session go to
+    the worker chosen by the session name, so that all members of the session meet in the same worker
+    '''
+
+
+    def __init__(self, zeromq_context, control_endpoint, exchange_id, config, workers):
+        self.ctx = zeromq_context
+        self.control_endpoint_name = control_endpoint
+        self.exchange_id = exchange_id
+        self.config = config
+        self.workers_count = workers
+        self.workers = []
+        # Worker id of each assigned peer, and number of its start commands that were not released yet
+        self.assignments = {}
+        self.active = {}
+        # Number of active streams of each worker
+        self.load = {}
+        # Packets for peers whose queue was full, sent in order once the peer reads its data
+        self.backlog = {}
+        self.processes = []
+        self.run = False
+        self.ready = threading.Event()
+
+    def start(self, timeout=30):
+        self.thread = threading.Thread(target=self.poolLoop, args=(timeout,))
+        self.thread.start()
+        self.ready.wait(timeout)
+
+    def stop(self, timeout=1000):
+        if not self.run:
+            return
+        # The loop stops when it handles the command, stopping it before could leave the command unsent
+        signal = self.ctx.socket(zmq.REQ)
+        signal.connect(self.control_endpoint_name)
+        # A peer may have shut the loop down meanwhile, leaving nobody to take the command
+        while self.thread.is_alive():
+            try:
+                signal.send_multipart([b'\x01', json.dumps({"command" : "shutdown"}).encode('utf-8')], zmq.NOBLOCK)
+                break
+            except zmq.Again:
+                self.thread.join(0.01)
+        self.thread.join(timeout)
+        signal.close(linger=0)
+
+    def wait(self):
+        self.thread.join()
+
+    def poolLoop(self, timeout):
+        self.backend = self.ctx.socket(zmq.ROUTER)
+        self.backend.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        port = self.backend.bind_to_random_port("tcp://127.0.0.1")
+        mp = multiprocessing.get_context('spawn')
+        for _ in range(0, self.workers_count):
+            process = mp.Process(target=run_worker, args=("tcp://127.0.0.1:" + str(port), self.exchange_id, self.config), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        try:
+            while len(self.workers) < self.workers_count:
+                if not self.backend.poll(timeout * 1000):
+                    raise EventloopError("Workers did not start in time")
+                in_packet = self.backend.recv_multipart()
+                if in_packet[1:] == [b'', b'ready']:
+                    self.workers.append(in_packet[0])
+                    self.load[in_packet[0]] = 0
+        except EventloopError as e:
+            print("Error:", e)
+            self.shutdownWorkers()
+            self.backend.close()
+            self.ready.set()
+            return
+
+        self.control = self.ctx.socket(zmq.ROUTER)
+        self.control.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.control.bind(self.control_endpoint_name)
+
+        self.poller = zmq.Poller()
+        self.poller.register(self.control, zmq.POLLIN)
+        self.poller.register(self.backend, zmq.POLLIN)
+        self.run = True
+        self.ready.set()
+        while self.run:
+            # Peers with backlog are retried often, as there is no way to poll for a single peer becoming writable
+            events = dict(self.poller.poll(5 if self.backlog else 100))
+            if events.get(self.control, 0) & zmq.POLLIN:
+                self.forwardFromPeers()
+            if events.get(self.backend, 0) & zmq.POLLIN:
+                self.forwardFromWorkers()
+            for peer_id in list(self.backlog.keys()):
+                self.flushBacklog(peer_id)
+
+        self.shutdownWorkers()
+        self.control.close()
+        self.backend.close()
+
+    def forwardFromPeers(self):
+        for _ in range(0, 1000):
+            try:
+                in_packet = self.control.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            peer_id = in_packet[0].bytes
+            command = None
+            session = None
+            if len(in_packet) > 3 and in_packet[2].bytes == b'\x01':
+                try:
+                    parsed = json.loads(in_packet[3].bytes.decode('utf-8'))
+                    command = parsed.get("command")
+                    session = parsed.get("session")
+                except (ValueError, AttributeError):
+                    pass
+            if command == "shutdown":
+                self.sendToPeer([peer_id, b'', b'\x01', json.dumps({"result" : "success"}).encode('utf-8')])
+                self.run = False
+                return
+            worker_id = self.workerFor(peer_id, command == "start", session if command == "start" else None)
+            if command == "start":
+                self.active[peer_id] += 1
+                self.load[worker_id] += 1
+            self.backend.send_multipart([worker_id] + in_packet, copy=False)
+
+    def forwardFromWorkers(self):
+        for _ in range(0, 1000):
+            try:
+                in_packet = self.backend.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            if in_packet[1].bytes == b'':
+                # Notification of the worker itself: [b'', b'released', peer id]
+                if in_packet[2].bytes == b'released':
+                    self.release(in_packet[3].bytes)
+                continue
+            self.sendToPeer(in_packet[1:])
+
+    def sendToPeer(self, packet):
+        peer_id = packet[0] if isinstance(packet[0], bytes) else packet[0].bytes
+        backlog = self.backlog.get(peer_id)
+        if backlog is not None:
+            backlog.append(packet)
+            return
+        try:
+            self.control.send_multipart(packet, zmq.NOBLOCK, copy=False)
+        except zmq.Again:
+            # Workers only send what the peer gave credit for, so the backlog of a peer is bounded by its credit
+            self.backlog[peer_id] = collections.deque([packet])
+        except zmq.ZMQError as e:
+            print("Error: unable to send data to peer:", e)
+
+    def flushBacklog(self, peer_id):
+        backlog = self.backlog[peer_id]
+        while backlog:
+            try:
+                self.control.send_multipart(backlog[0], zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            except zmq.ZMQError as e:
+                print("Error: unable to send data to peer:", e)
+            backlog.popleft()
+        del self.backlog[peer_id]
+
+    def workerFor(self, peer_id, assign, session=None):
+        '''
+        Worker of the peer. Packets of peers without streams go to the least loaded worker, or to the worker of
+        'session', which replies or reports the error, but only start commands assign the peer to it
+        '''
+        worker_id = self.assignments.get(peer_id)
+        if worker_id is None:
+            if isinstance(session, str):
+                worker_id = self.workers[zlib.crc32(session.encode('utf-8')) % len(self.workers)]
+            else:
+                worker_id = min(self.workers, key=lambda w: self.load[w])
+            if assign:
+                self.assignments[peer_id] = worker_id
+                self.active[peer_id] = 0
+        return worker_id
+
+    def release(self, peer_id):
+        worker_id = self.assignments.get(peer_id)
+        if worker_id is None:
+            return
+        self.load[worker_id] -= 1
+        self.active[peer_id] -= 1
+        if self.active[peer_id] <= 0:
+            del self.assignments[peer_id]
+            del self.active[peer_id]
+
+    def shutdownWorkers(self):
+        for worker_id in self.workers:
+            try:
+                self.backend.send_multipart([worker_id, b'pool', b'', b'\x01', json.dumps({"command" : "shutdown"}).encode('utf-8')], zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                print("Error: unable to stop worker:", e)
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()